@@ -0,0 +1,51 @@
+# Compares the two AudioScheduler modes on the drums puzzle loop: splitting
+# each buffer at every command (one synth render per piece) against the event
+# queue (one synth render per buffer). Prints synth render calls and CPU time.
+#
+# usage: python bench_drums.py [level]
+import sys
+import time
+
+from common.audio import Audio, OfflineAudio
+from common.clock import AudioScheduler, SimpleTempoMap
+from common.synth import Synth
+from render_levels import drum_pattern_to_beats
+from src.audio_engine import kSoundfontPath
+from src.levels import drums_levels as levels
+from src.puzzle_sound import NoteSequencer
+
+kSeconds = 30
+
+
+def run(pattern, bpm, event_queue):
+    synth = Synth(kSoundfontPath, lazy=True)
+    sched = AudioScheduler(SimpleTempoMap(bpm), event_queue=event_queue)
+    sched.set_generator(synth)
+
+    beats = drum_pattern_to_beats(pattern)
+    note_seq = NoteSequencer(sched, synth, channel=1, program=(128, 0), notes=beats, loop=True)
+    note_seq.start()
+
+    audio = OfflineAudio(2, block_size=Audio.buffer_size)
+    audio.set_generator(sched)
+
+    t = time.process_time()
+    audio.render(kSeconds * Audio.sample_rate)
+    cpu = time.process_time() - t
+
+    num_renders = synth.num_renders
+    synth.delete()
+    return num_renders, cpu
+
+
+if __name__ == "__main__":
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    pattern = levels[level]
+    num_buffers = kSeconds * Audio.sample_rate // Audio.buffer_size
+
+    print(f"drums level {level}, {kSeconds}s in {num_buffers} buffers of {Audio.buffer_size}")
+    for bpm in (120, 240):
+        for event_queue in (False, True):
+            num_renders, cpu = run(pattern, bpm, event_queue)
+            mode = "event queue" if event_queue else "split"
+            print(f"{bpm} bpm {mode:>11}: {num_renders:6d} synth renders, {cpu:.3f}s cpu")
@@ -0,0 +1,148 @@
+# Packs the images drawn on grid tiles (floor, walls, doors, the character,
+# room icons and puzzle pieces) into a few texture atlas pages. Each image is
+# first downsampled to the largest tile Grid.calculate_dims can produce, so
+# no page holds more pixels than the screen can show. Writes the pages and a
+# JSON index of each image's region to data/atlas/, and prints the decode
+# time and texture memory of the separate images against the atlas pages.
+#
+# The game picks the atlas up automatically (see src/textures.py). Rerun
+# this after changing any of the images.
+#
+# usage: python build_atlas.py
+import json
+import math
+import os
+import time
+
+from PIL import Image, ImageFile
+
+# some of the PNGs have a broken checksum on an ancillary chunk (eg, iCCP),
+# which doesn't affect the pixels. Let PIL skip those instead of failing
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+kAtlasDir = "./data/atlas"
+kPageSize = 1024
+kPadding = 2
+
+# Grid.calculate_dims: tile side = (min(width, height) - 2 * margin) / (9 + 2),
+# largest on the biggest screen we support (4K)
+kMaxScreenSide = 2160
+kMaxTileSide = int(math.ceil((kMaxScreenSide - 2 * 20) / 11))
+
+kSources = [
+    "./data/sand1.png",
+    "./data/sand3.png",
+    "./data/brickfloor.png",
+    "./data/Door_up.png",
+    "./data/door_down.png",
+    "./data/door_left.png",
+    "./data/Door_right.png",
+    "./data/character_up.png",
+    "./data/character_down.png",
+    "./data/character_left.png",
+    "./data/character_right.png",
+    "./data/pyramid.png",
+    "./data/bass.png",
+    "./data/drums.png",
+    "./data/piano.png",
+    "./data/guitar.png",
+    "./data/pitch_slider.png",
+    "./data/rhythm_slider.png",
+    "./data/key_slider.png",
+    "./data/trackv2.png",
+    "./data/button_down.png",
+    "./data/button_up.png",
+    "./data/boulder.jpg",
+    "./data/wall_button.png",
+    "./data/sarco.jpg",
+    "./data/mummy.jpg",
+    "./data/anubis.jpg",
+    "./data/ra.png",
+]
+
+
+# seconds to decode the files, and bytes of RGBA texture memory they take
+def measure(filepaths):
+    t = time.perf_counter()
+    num_bytes = 0
+    for filepath in filepaths:
+        image = Image.open(filepath)
+        image.load()
+        num_bytes += image.width * image.height * 4
+    return time.perf_counter() - t, num_bytes
+
+
+def load_scaled(filepath):
+    image = Image.open(filepath).convert("RGBA")
+    image.thumbnail((kMaxTileSide, kMaxTileSide), Image.LANCZOS)
+    return image
+
+
+# copy image into page at (x, y), repeating its edge pixels into the padding
+# around it so that filtering at the region's border doesn't bleed in its
+# neighbors
+def paste_padded(page, image, x, y):
+    w, h = image.size
+    p = kPadding
+    page.paste(image, (x + p, y + p))
+    page.paste(image.crop((0, 0, w, 1)).resize((w, p)), (x + p, y))
+    page.paste(image.crop((0, h - 1, w, h)).resize((w, p)), (x + p, y + p + h))
+    page.paste(image.crop((0, 0, 1, h)).resize((p, h)), (x, y + p))
+    page.paste(image.crop((w - 1, 0, w, h)).resize((p, h)), (x + p + w, y + p))
+
+
+# shelf packing: tallest images first, left to right in rows, new page when
+# a page is full. Returns the pages and each source's (page, x, y, w, h) with
+# y measured from the top
+def pack(images):
+    pages = []
+    placements = {}
+    x = y = shelf_h = 0
+    order = sorted(images, key=lambda source: images[source].height, reverse=True)
+    for source in order:
+        image = images[source]
+        w = image.width + 2 * kPadding
+        h = image.height + 2 * kPadding
+        if x + w > kPageSize:
+            x, y, shelf_h = 0, y + shelf_h, 0
+        if not pages or y + h > kPageSize:
+            pages.append(Image.new("RGBA", (kPageSize, kPageSize)))
+            x = y = shelf_h = 0
+
+        paste_padded(pages[-1], image, x, y)
+        placements[source] = (len(pages) - 1, x + kPadding, y + kPadding, image.width, image.height)
+        x += w
+        shelf_h = max(shelf_h, h)
+    return pages, placements
+
+
+if __name__ == "__main__":
+    os.makedirs(kAtlasDir, exist_ok=True)
+
+    images = {source: load_scaled(source) for source in kSources}
+    pages, placements = pack(images)
+
+    page_names = [f"atlas-{i}.png" for i in range(len(pages))]
+    for name, page in zip(page_names, pages):
+        page.save(os.path.join(kAtlasDir, name), optimize=True)
+
+    # regions are (x, y, w, h) in kivy texture coordinates (y up from the
+    # bottom), uvs are (u0, v0, u1, v1)
+    regions = {}
+    for source, (page, x, y, w, h) in placements.items():
+        y = kPageSize - y - h
+        regions[os.path.normpath(source)] = {
+            "page": page,
+            "region": [x, y, w, h],
+            "uv": [x / kPageSize, y / kPageSize, (x + w) / kPageSize, (y + h) / kPageSize],
+        }
+
+    index = {"pages": page_names, "tile_size": kMaxTileSide, "regions": regions}
+    with open(os.path.join(kAtlasDir, "atlas.json"), "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+
+    before_time, before_bytes = measure(kSources)
+    after_time, after_bytes = measure(os.path.join(kAtlasDir, name) for name in page_names)
+    print(f"{len(kSources)} images at most {kMaxTileSide}px into {len(pages)} pages of {kPageSize}px")
+    print(f"before: {len(kSources)} files, {1000 * before_time:.1f}ms decode, {before_bytes / 2 ** 20:.1f}MB textures")
+    print(f"after:  {len(pages)} files, {1000 * after_time:.1f}ms decode, {after_bytes / 2 ** 20:.1f}MB textures")
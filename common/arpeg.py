@@ -8,9 +8,26 @@
 #
 #####################################################################
 
+import math
+from collections import deque
+
 from .clock import kTicksPerQuarter, quantize_tick_up
 
+kTicksPerBar = 4 * kTicksPerQuarter
+
 
+# The arpeggio (pitch order, rhythm and velocity) is compiled into a cyclic
+# table of note-on / note-off events, one pair per step of the cycle. While
+# playing, a whole bar of events is posted to the scheduler in one call, and
+# the next bar is posted when the last step of the current one starts.
+#
+# With an articulation of 1 (legato), a note ends exactly when the next one
+# starts, so each step is a single command: its note-on also turns off the
+# previous note. Shorter (or overlapping) notes need a separate note-off.
+#
+# Changing the pitches, rhythm or direction recompiles the table and replaces
+# the events of the steps that have not started yet, so the change is heard
+# from the next step on (on the new rhythm's grid).
 class Arpeggiator(object):
     def __init__(self, sched, synth, channel=0, program=(0, 40), callback = None):
         super(Arpeggiator, self).__init__()
@@ -26,12 +43,21 @@ class Arpeggiator(object):
         self.articulation = 0.75
         self.pitches = [60, 64, 67, 72]
         self.direction = 'up'
+        self.velocity = 100
+
+        # compiled table: (note-on event, note-off event) per step of the cycle
+        self.table = []
+        self.note_len = 0
+        self.legato = False
+        self.steps_per_bar = 0
+        self._compile()
 
         # run-time variables
-        self.cur_idx = 0
-        self.idx_inc = 1
-        self.on_cmd = None
-        self.off_cmd = None
+        self.cur_idx = 0            # table index of the next step to post
+        self.next_bar_tick = 0      # tick of the next step to post
+        self.pending = deque()      # (table index, on_cmd, off_cmd) of posted steps not yet started
+        self.off_cmd = None         # note-off of the last note started (None if legato)
+        self.sounding = None        # pitch of the last note started, until its note-off
         self.playing = False
 
     def start(self):
@@ -40,82 +66,189 @@ class Arpeggiator(object):
 
             self.synth.program(self.channel, self.program[0], self.program[1])
             now = self.sched.get_tick()
-            next_tick = quantize_tick_up(now, self.length)
-            self.on_cmd  = self.sched.post_at_tick(self._noteon, next_tick, None)
+            self._post_bar(quantize_tick_up(now, self.length))
 
     def stop(self):
         if self.playing:
             self.playing = False
 
-            self.sched.remove(self.on_cmd)
+            self._cancel_pending()
             self.sched.remove(self.off_cmd)
-            if self.off_cmd:
-                self.off_cmd.execute()
+            if self.sounding is not None:
+                self.synth.noteoff(self.channel, self.sounding)
 
-            # reset these so we don't have a reference to old commands.
-            self.on_cmd = None
+            # reset this so we don't have a reference to an old command.
             self.off_cmd = None
+            self.sounding = None
 
     # pitches is a list of MIDI pitch values. For example [60 64 67 72]
     def set_pitches(self, pitches):
         self.pitches = pitches
-        if self.cur_idx >= len(pitches):
-            self.cur_idx = len(pitches) - 1
+        self._update()
 
     def set_rhythm(self, length, articulation):
         self.length = length
         self.articulation = articulation
+        self._update()
 
     # dir is either 'up', 'down', or 'updown'
     def set_direction(self, direction):
         assert (direction == 'up' or direction == 'down' or direction == 'updown')
         self.direction = direction
-        if direction == 'up':
-            self.idx_inc = 1
-        elif direction == 'down':
-            self.idx_inc = -1
-
-    # find the pitch we should play based on the notes, the current note index
-    # and the direction variable.
-    def _get_next_pitch(self):
-        pitch = self.pitches[self.cur_idx]
-
-        notes_len = len(self.pitches)
-
-        # flip detection if 'updown' and at endpoint
-        if self.direction == 'updown':
-            if self.cur_idx == 0:
-                self.idx_inc = 1
-            elif self.cur_idx == notes_len-1:
-                self.idx_inc = -1
-
-        # advance index
-        self.cur_idx += self.idx_inc
-
-        # keep in bounds:
-        self.cur_idx = self.cur_idx % notes_len
-
-        return pitch
-
-    def _noteon(self, tick, ignore):
-        pitch = self._get_next_pitch()
-
-        # play note on:
-        velocity = 100
+        self._update()
+
+    def set_velocity(self, velocity):
+        self.velocity = velocity
+        self._update()
+
+    # the order in which pitch indices are played over one cycle
+    def _get_order(self):
+        n = len(self.pitches)
+        if self.direction == 'up':
+            return list(range(n))
+        elif self.direction == 'down':
+            return list(range(n - 1, -1, -1))
+        else:
+            # 0 1 .. n-1 n-2 .. 1, then repeat
+            return list(range(n)) + list(range(n - 2, 0, -1))
+
+    def _compile(self):
+        self.table = [((True, self.pitches[i], self.velocity), (False, self.pitches[i], 0))
+                      for i in self._get_order()]
+        self.note_len = self.articulation * self.length
+        self.legato = self.articulation == 1
+        self.steps_per_bar = max(1, int(math.ceil(kTicksPerBar / self.length)))
+
+    # recompile, and if playing, replace the steps that have not started yet
+    def _update(self):
+        if not self.playing:
+            self._compile()
+            self.cur_idx = self.cur_idx % len(self.table) if self.table else 0
+            return
+
+        if self.pending:
+            idx, on_cmd, off_cmd = self.pending[0]
+            tick = on_cmd.tick
+            self._cancel_pending()
+        else:
+            # nothing posted, because there were no pitches: start again from
+            # the next step after now
+            idx = self.cur_idx
+            tick = self.sched.get_tick() + 1
+
+        self._compile()
+        self.cur_idx = idx % len(self.table) if self.table else 0
+
+        # first step boundary at or after tick on the (possibly new) grid
+        self._post_bar(int(math.ceil(tick / self.length) * self.length))
+
+    # post the events of a bar's worth of steps, starting at tick
+    def _post_bar(self, tick):
+        if not self.table:
+            return
+
+        ticks = []
+        events = []
+        idxs = []
+        for j in range(self.steps_per_bar):
+            idx = (self.cur_idx + j) % len(self.table)
+            on_event, off_event = self.table[idx]
+            on_tick = tick + j * self.length
+            ticks.append(on_tick)
+            events.append(on_event)
+            if not self.legato:
+                ticks.append(on_tick + self.note_len)
+                events.append(off_event)
+            idxs.append(idx)
+
+        cmds = self.sched.post_at_ticks(self._play, ticks, events)
+        if self.legato:
+            for j, idx in enumerate(idxs):
+                self.pending.append((idx, cmds[j], None))
+        else:
+            for j, idx in enumerate(idxs):
+                self.pending.append((idx, cmds[2 * j], cmds[2 * j + 1]))
+
+        self.cur_idx = (self.cur_idx + self.steps_per_bar) % len(self.table)
+        self.next_bar_tick = tick + self.steps_per_bar * self.length
+
+    def _cancel_pending(self):
+        for idx, on_cmd, off_cmd in self.pending:
+            self.sched.remove(on_cmd)
+            self.sched.remove(off_cmd)
+        self.pending.clear()
+
+    def _play(self, tick, event):
+        note_on, pitch, velocity = event
+
+        if not note_on:
+            self.synth.noteoff(self.channel, pitch)
+            if self.sounding == pitch:
+                self.sounding = None
+            return
+
+        # a note started legato has no note-off of its own: it ends as the
+        # next one starts
+        if self.sounding is not None and self.off_cmd is None:
+            self.synth.noteoff(self.channel, self.sounding)
+
+        idx, on_cmd, self.off_cmd = self.pending.popleft()
         self.synth.noteon(self.channel, pitch, velocity)
-
-        # post the note-off at the appropriate tick:
-        length = self.articulation * self.length
-        off_tick = tick + length
-        self.off_cmd = self.sched.post_at_tick(self._noteoff, off_tick, pitch)
+        self.sounding = pitch
 
         # callback:
         if self.callback:
-            self.callback(tick, pitch, velocity, length)
-
-        # post next note. quantize tick to line up with grid of current note length
-        next_tick = quantize_tick_up(tick, self.length)
-        self.on_cmd  = self.sched.post_at_tick(self._noteon, next_tick, None)
-
-    def _noteoff(self, tick, pitch):
-        self.synth.noteoff(self.channel, pitch)
+            self.callback(tick, pitch, velocity, self.note_len)
+
+        # last posted step has started: post the next bar
+        if not self.pending:
+            self._post_bar(self.next_bar_tick)
+
+
+# benchmark: scheduler traffic of an arpeggio of sixteenth notes, staccato and
+# legato, counted as calls that post commands and as commands posted.
+# Run with: python -m common.arpeg
+if __name__ == "__main__":
+    from .audio import Audio
+    from .clock import AudioScheduler, SimpleTempoMap
+
+    class NullSynth(object):
+        def program(self, chan, bank, preset): pass
+        def noteon(self, chan, key, vel): pass
+        def noteoff(self, chan, key): pass
+
+    class CountingScheduler(AudioScheduler):
+        def __init__(self, tempo_map):
+            super(CountingScheduler, self).__init__(tempo_map)
+            self.num_posts = 0
+            self.num_commands = 0
+
+        def post_at_tick(self, func, tick, arg=None):
+            self.num_posts += 1
+            self.num_commands += 1
+            return super(CountingScheduler, self).post_at_tick(func, tick, arg)
+
+        def post_at_ticks(self, func, ticks, args):
+            self.num_posts += 1
+            self.num_commands += len(ticks)
+            return super(CountingScheduler, self).post_at_ticks(func, ticks, args)
+
+    num_bars = 64
+    for articulation in (0.75, 1.0):
+        sched = CountingScheduler(SimpleTempoMap(120))
+        arpeg = Arpeggiator(sched, NullSynth())
+        arpeg.set_direction('updown')
+        arpeg.set_rhythm(kTicksPerQuarter / 4, articulation)
+        arpeg.start()
+
+        num_steps = [0]
+        arpeg.callback = lambda tick, pitch, vel, length: num_steps.__setitem__(0, num_steps[0] + 1)
+        num_frames = int(sched.tempo_map.tick_to_time(num_bars * kTicksPerBar) * Audio.sample_rate)
+        for i in range(num_frames // 512):
+            sched.generate(512, 2)
+            if i == 100:
+                arpeg.set_pitches([60, 63, 67, 70, 72])
+
+        steps = num_steps[0]
+        print('articulation %.2f, %d steps: %.3f posts/step, %.3f commands/step' %
+              (articulation, steps, sched.num_posts / float(steps), sched.num_commands / float(steps)))
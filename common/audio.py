@@ -8,15 +8,15 @@
 #
 #####################################################################
 
+import collections
 import os.path
 import sys
+import threading
 import time
 
 import numpy as np
 import pyaudio
 
-from common import core
-
 sys.path.append(".")
 sys.path.append("..")
 
@@ -28,6 +28,12 @@ class Audio(object):
     out_dev = None
     in_dev = None
 
+    # callback (pull) mode parameters. In callback mode, PortAudio asks for
+    # audio from its own thread and a render thread keeps a ring buffer
+    # filled roughly callback_latency seconds ahead of the device.
+    callback_mode = False
+    callback_latency = 0.05
+
     def __init__(
         self, num_channels, listen_func=None, input_func=None, num_input_channels=1
     ):
@@ -45,6 +51,11 @@ class Audio(object):
         if "-asio" in sys.argv:
             Audio.out_dev, Audio.in_dev = self._find_asio_devices()
 
+        # if '-callback' found in command-line-args, use callback (pull) mode
+        if "-callback" in sys.argv:
+            Audio.callback_mode = True
+        self.callback_mode = Audio.callback_mode
+
         # print("using audio params:")
         # print(
         #     f"  samplerate: {Audio.sample_rate}\n"
@@ -54,6 +65,19 @@ class Audio(object):
         # )
         print("Creating audio object")
 
+        # callback mode state. Game code talks to the generators through
+        # cmd_queue (see post()), which the render thread drains before
+        # every block it renders. main_queue goes the other way (see
+        # post_to_main()) and is drained by on_update().
+        self.cmd_queue = collections.deque()
+        self.main_queue = collections.deque()
+        self.num_underruns = 0
+        self.callback_time = 0
+        self.ring = None
+        self.render_thread = None
+        if self.callback_mode:
+            self._init_callback_mode()
+
         # create output stream
         self.stream = self.audio.open(
             format=pyaudio.paFloat32,
@@ -63,6 +87,7 @@ class Audio(object):
             output=True,
             input=False,
             output_device_index=Audio.out_dev,
+            stream_callback=self._callback if self.callback_mode else None,
         )
 
         # create input stream
@@ -80,9 +105,22 @@ class Audio(object):
 
         self.generator = None
         self.cpu_time = 0
+
+        # imported here so that modules built on Audio (clock, synth, ...) can
+        # be used offline without Kivy
+        from common import core
         core.register_terminate_func(self.close)
 
+        if self.callback_mode:
+            self.render_thread.start()
+
     def close(self):
+        if self.render_thread:
+            self.rendering = False
+            self.render_event.set()
+            self.render_thread.join()
+            self.render_thread = None
+
         self.stream.stop_stream()
         self.stream.close()
         if self.input_stream:
@@ -101,10 +139,43 @@ class Audio(object):
     def get_cpu_load(self):
         return 1000 * self.cpu_time
 
+    # return time spent inside the PortAudio callback in milliseconds
+    def get_callback_load(self):
+        return 1000 * self.callback_time
+
+    # number of times the device asked for audio that was not ready yet
+    def get_num_underruns(self):
+        return self.num_underruns
+
+    # run func(*args) on the audio thread before the next rendered block.
+    # In polled mode there is no audio thread, so func is called right away.
+    # Use this to talk to generators (synth, scheduler, etc) from game code
+    # when callback mode is on.
+    def post(self, func, *args):
+        if self.callback_mode:
+            self.cmd_queue.append((func, args))
+        else:
+            func(*args)
+
+    # run func(*args) on the main thread, from the next on_update(). In polled
+    # mode the generators already run on the main thread, so func is called
+    # right away. Use this from generators (eg, scheduler commands) for
+    # anything that touches Kivy.
+    def post_to_main(self, func, *args):
+        if self.callback_mode:
+            self.main_queue.append((func, args))
+        else:
+            func(*args)
+
     # must call this every frame.
     def on_update(self):
         t_start = time.time()
 
+        # callbacks posted from the audio thread
+        while self.main_queue:
+            func, args = self.main_queue.popleft()
+            func(*args)
+
         # get input audio if desired
         if self.input_stream:
             try:
@@ -118,6 +189,10 @@ class Audio(object):
             except IOError as e:
                 print("got error", e)
 
+        # in callback mode, the render thread does the rest
+        if self.callback_mode:
+            return
+
         # Ask the generator to generate some audio samples.
         num_frames = self.stream.get_write_available()  # number of frames to supply
         if self.generator and num_frames != 0:
@@ -149,6 +224,80 @@ class Audio(object):
         a = 0.9
         self.cpu_time = a * self.cpu_time + (1 - a) * dt
 
+    def _init_callback_mode(self):
+        # ring buffer holds twice the target latency so the render thread
+        # never has to wait on the callback to make room
+        latency_frames = max(
+            Audio.buffer_size, int(Audio.callback_latency * Audio.sample_rate)
+        )
+        self.latency_samples = latency_frames * self.num_channels
+        self.ring = RingBuffer(2 * self.latency_samples)
+        self.callback_buf = np.zeros(
+            Audio.buffer_size * self.num_channels * 4, dtype=np.float32
+        )
+
+        self.rendering = True
+        self.render_event = threading.Event()
+        self.render_thread = threading.Thread(target=self._render_loop, daemon=True)
+
+    # called by PortAudio on its own thread. Only copies out of the ring
+    # buffer, so it never waits on the generators.
+    def _callback(self, in_data, frame_count, time_info, status):
+        t_start = time.perf_counter()
+
+        num_samples = frame_count * self.num_channels
+        if num_samples > len(self.callback_buf):
+            self.callback_buf = np.zeros(num_samples, dtype=np.float32)
+        out = self.callback_buf[:num_samples]
+
+        got = self.ring.read(out)
+        if got < num_samples:
+            out[got:] = 0
+            if self.generator:
+                self.num_underruns += 1
+        elif status & pyaudio.paOutputUnderflow:
+            self.num_underruns += 1
+
+        # wake the render thread to refill
+        self.render_event.set()
+
+        dt = time.perf_counter() - t_start
+        a = 0.9
+        self.callback_time = a * self.callback_time + (1 - a) * dt
+        return (out.tobytes(), pyaudio.paContinue)
+
+    # render thread: keep the ring buffer filled up to the target latency
+    def _render_loop(self):
+        block_samples = Audio.buffer_size * self.num_channels
+        while self.rendering:
+            # commands posted from game code
+            while self.cmd_queue:
+                func, args = self.cmd_queue.popleft()
+                func(*args)
+
+            generator = self.generator
+            if generator and self.ring.get_read_available() < self.latency_samples:
+                t_start = time.time()
+                (data, continue_flag) = generator.generate(
+                    Audio.buffer_size, self.num_channels
+                )
+                assert len(data) == block_samples
+
+                self.ring.write(data)
+
+                if self.listen_func:
+                    self.listen_func(data, self.num_channels)
+
+                if not continue_flag:
+                    self.generator = None
+
+                dt = time.time() - t_start
+                a = 0.9
+                self.cpu_time = a * self.cpu_time + (1 - a) * dt
+            else:
+                self.render_event.wait(0.005)
+                self.render_event.clear()
+
     # look for the ASIO devices and return them (output, input)
     def _find_asio_devices(self):
         out_dev = in_dev = None
@@ -164,6 +313,111 @@ class Audio(object):
         return out_dev, in_dev
 
 
+# Drives a generator chain without a sound card, as fast as the CPU allows.
+# Same generator interface as Audio, but instead of on_update() you ask for a
+# number of frames with render(). Useful for regression tests and batch
+# rendering. get_realtime_factor() reports how many seconds of audio were
+# rendered per second of wall-clock time.
+class OfflineAudio(object):
+    def __init__(self, num_channels, block_size=8192):
+        super(OfflineAudio, self).__init__()
+        assert num_channels == 1 or num_channels == 2
+        self.num_channels = num_channels
+        self.block_size = block_size
+        self.generator = None
+
+        self.frames_rendered = 0
+        self.render_time = 0
+
+    def set_generator(self, gen):
+        self.generator = gen
+
+    # render num_frames of audio into out (a float32 array of length
+    # num_frames * num_channels, allocated if not given) and return it
+    def render(self, num_frames, out=None):
+        num_samples = num_frames * self.num_channels
+        if out is None:
+            out = np.zeros(num_samples, dtype=np.float32)
+        assert len(out) >= num_samples
+
+        t_start = time.perf_counter()
+        frame = 0
+        while frame < num_frames and self.generator:
+            n = min(self.block_size, num_frames - frame)
+            (data, continue_flag) = self.generator.generate(n, self.num_channels)
+            assert len(data) == n * self.num_channels, (
+                "asked for (%d * %d) frames but got %d"
+                % (n, self.num_channels, len(data))
+            )
+            s = frame * self.num_channels
+            out[s : s + len(data)] = data
+            frame += n
+
+            if not continue_flag:
+                self.generator = None
+
+        # a finished chain renders silence
+        out[frame * self.num_channels : num_samples] = 0
+
+        self.render_time += time.perf_counter() - t_start
+        self.frames_rendered += num_frames
+        return out
+
+    # render num_frames of audio and save them as a 16 bit wave file
+    def render_to_file(self, num_frames, filepath):
+        from .writer import write_wave_file
+
+        data = self.render(num_frames)
+        write_wave_file(data, self.num_channels, filepath)
+        return data
+
+    # seconds of audio rendered per second of cpu time
+    def get_realtime_factor(self):
+        if self.render_time == 0:
+            return 0
+        return (self.frames_rendered / float(Audio.sample_rate)) / self.render_time
+
+
+# Single-producer / single-consumer ring buffer of float32 samples. One thread
+# may write while another reads without any locking: each side only ever
+# advances its own counter.
+class RingBuffer(object):
+    def __init__(self, size):
+        super(RingBuffer, self).__init__()
+        self.size = size
+        self.buf = np.zeros(size, dtype=np.float32)
+
+        # total samples written / read so far. Never wrapped.
+        self.write_count = 0
+        self.read_count = 0
+
+    def get_read_available(self):
+        return self.write_count - self.read_count
+
+    def get_write_available(self):
+        return self.size - (self.write_count - self.read_count)
+
+    # write as much of data as fits. Returns number of samples written
+    def write(self, data):
+        num = min(len(data), self.get_write_available())
+        start = self.write_count % self.size
+        first = min(num, self.size - start)
+        self.buf[start : start + first] = data[:first]
+        self.buf[: num - first] = data[first:num]
+        self.write_count += num
+        return num
+
+    # fill out with as many samples as available. Returns number of samples read
+    def read(self, out):
+        num = min(len(out), self.get_read_available())
+        start = self.read_count % self.size
+        first = min(num, self.size - start)
+        out[:first] = self.buf[start : start + first]
+        out[first:num] = self.buf[: num - first]
+        self.read_count += num
+        return num
+
+
 def get_audio_devices():
     """Returns the available input and output devices as { 'input': <list>, 'output': <list> }
 <list> is a list of device descriptors, each being a dictionary:
@@ -186,6 +186,16 @@ fluid_synth_write_s16 = cfunc('fluid_synth_write_s16', c_void_p,
                               ('roff', c_int, 1),
                               ('rincr', c_int, 1))
 
+fluid_synth_write_float = cfunc('fluid_synth_write_float', c_int,
+                                ('synth', c_void_p, 1),
+                                ('len', c_int, 1),
+                                ('lbuf', c_void_p, 1),
+                                ('loff', c_int, 1),
+                                ('lincr', c_int, 1),
+                                ('rbuf', c_void_p, 1),
+                                ('roff', c_int, 1),
+                                ('rincr', c_int, 1))
+
 # fluid audio driver
 new_fluid_audio_driver = cfunc('new_fluid_audio_driver', c_void_p,
                                ('settings', c_void_p, 1),
@@ -431,6 +441,23 @@ fluid_event_noteoff = cfunc('fluid_event_noteoff', None,
                          ('channel', c_int, 1),
                          ('key', c_short, 1))
 
+fluid_event_program_change = cfunc('fluid_event_program_change', None,
+                         ('evt', c_void_p, 1),
+                         ('channel', c_int, 1),
+                         ('val', c_short, 1))
+
+fluid_event_program_select = cfunc('fluid_event_program_select', None,
+                         ('evt', c_void_p, 1),
+                         ('channel', c_int, 1),
+                         ('sfont_id', c_uint, 1),
+                         ('bank_num', c_short, 1),
+                         ('preset_num', c_short, 1))
+
+fluid_event_control_change = cfunc('fluid_event_control_change', None,
+                         ('evt', c_void_p, 1),
+                         ('channel', c_int, 1),
+                         ('control', c_short, 1),
+                         ('val', c_short, 1))
 
 delete_fluid_event = cfunc('delete_fluid_event', None,
                           ('evt', c_void_p, 1))
@@ -484,6 +511,25 @@ def fluid_synth_write_s16_stereo(synth, len):
     fluid_synth_write_s16(synth, len, buf, 0, 2, buf, 1, 2)
     return numpy.frombuffer(buf[:], dtype=numpy.int16)
 
+def fluid_synth_write_float_stereo(synth, out, interleaved=True):
+    """Generate stereo float samples directly into out
+
+    out is a C-contiguous NumPy float32 array owned by the caller. If
+    interleaved, it holds 2 * len samples (L R L R ...). Otherwise it has
+    shape (2, len): the left channel followed by the right channel.
+    No intermediate buffers are created.
+
+    """
+    import numpy
+    assert out.dtype == numpy.float32 and out.flags['C_CONTIGUOUS']
+    ptr = out.ctypes.data
+    if interleaved:
+        len = out.size // 2
+        return fluid_synth_write_float(synth, len, ptr, 0, 2, ptr, 1, 2)
+    else:
+        len = out.shape[-1]
+        return fluid_synth_write_float(synth, len, ptr, 0, 1, ptr, len, 1)
+
 
 # Object-oriented interface, simplifies access to functions
 
@@ -502,9 +548,9 @@ class Synth:
         fluid_settings_setnum(st, b'synth.gain', gain)
         fluid_settings_setnum(st, b'synth.sample-rate', samplerate)
         fluid_settings_setint(st, b'synth.midi-channels', channels)
+        self.settings = st
         for opt,val in kwargs.items():
             self.setting(opt, val)
-        self.settings = st
         self.synth = new_fluid_synth(st)
         self.audio_driver = None
         self.midi_driver = None
@@ -788,6 +834,14 @@ class Synth:
 
         """
         return fluid_synth_write_s16_stereo(self.synth, len)
+    def write_float(self, out, interleaved=True):
+        """Generate audio samples into a caller-owned float32 array
+
+        out is either interleaved stereo of size 2 * len, or, if interleaved
+        is False, split stereo of shape (2, len). Samples are in [-1, 1].
+
+        """
+        return fluid_synth_write_float_stereo(self.synth, out, interleaved)
 
 class Sequencer:
     def __init__(self, time_scale=1000, use_system_timer=True):
@@ -836,6 +890,24 @@ class Sequencer:
         self._schedule_event(evt, time, absolute)
         delete_fluid_event(evt)
 
+    def program_change(self, time, channel, val, source=-1, dest=-1, absolute=True):
+        evt = self._create_event(source, dest)
+        fluid_event_program_change(evt, channel, val)
+        self._schedule_event(evt, time, absolute)
+        delete_fluid_event(evt)
+
+    def program_select(self, time, channel, sfid, bank, preset, source=-1, dest=-1, absolute=True):
+        evt = self._create_event(source, dest)
+        fluid_event_program_select(evt, channel, sfid, bank, preset)
+        self._schedule_event(evt, time, absolute)
+        delete_fluid_event(evt)
+
+    def control_change(self, time, channel, control, val, source=-1, dest=-1, absolute=True):
+        evt = self._create_event(source, dest)
+        fluid_event_control_change(evt, channel, control, val)
+        self._schedule_event(evt, time, absolute)
+        delete_fluid_event(evt)
+
     def timer(self, time, data=None, source=-1, dest=-1, absolute=True):
         evt = self._create_event(source, dest)
         fluid_event_timer(evt, data)
@@ -1,4 +1,3 @@
-
 #####################################################################
 #
 # metro.py
@@ -9,21 +8,84 @@
 #
 #####################################################################
 
+from collections import deque
+
+import numpy as np
+
+from .audio import Audio
 from .clock import kTicksPerQuarter, quantize_tick_up
 
+# rendered click sounds, by (freq, duration, gain)
+g_clicks = {}
+
+
+# a short decaying sine burst (mono, float32). Rendered once per set of
+# parameters and cached.
+def get_click(freq, duration = 0.03, gain = 1.0):
+    key = (freq, duration, gain)
+    if key not in g_clicks:
+        t = np.arange(int(duration * Audio.sample_rate)) / float(Audio.sample_rate)
+        env = np.exp(-t * (6.0 / duration))
+        # 1ms attack so the click doesn't pop
+        attack = int(0.001 * Audio.sample_rate)
+        env[:attack] *= np.linspace(0, 1, attack)
+        g_clicks[key] = (gain * env * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return g_clicks[key]
+
+
 class Metronome(object):
-    """Plays a steady click every beat.
+    """Plays a steady click every beat, with an accented click on the first
+    beat of each bar.
+
+    Metronome is a Generator: add it to the same Mixer as the scheduler whose
+    tempo it follows. Clicks are pre-rendered and mixed in at the exact frame
+    of each beat (computed from the tempo map), so no scheduler commands are
+    posted per beat.
+
+    If given a synth (the original interface), it instead plays a note on
+    that synth every beat through scheduler commands, as it used to, and
+    generates silence.
     """
-    def __init__(self, sched, synth, channel = 0, program=(128, 0)):
+    def __init__(self, sched, synth = None, channel = 0, program = (128, 0),
+                 num_beats = 4, beat_len = kTicksPerQuarter, gain = 0.5):
         super(Metronome, self).__init__()
         self.sched = sched
         self.synth = synth
         self.channel = channel
         self.program = program
+        self.tempo_map = sched.tempo_map
+        self.num_beats = num_beats
+        self.beat_len = beat_len
+
+        self.click = get_click(1000., gain = gain)
+        self.accent = get_click(1500., gain = gain * 1.5)
 
         # run-time variables
-        self.cmd = None
         self.playing = False
+        self.frame = 0              # frame at the start of the next buffer
+        self.origin = 0             # tick of the first beat of bar 0
+        self.next_beat = 0          # index (from origin) of the next beat to click
+        self.next_frame = None      # frame of next_beat, or None if not known
+        self.version = None         # tempo map version next_frame was computed with
+        self.sounding = deque()     # (start frame, click) of clicks still playing, oldest first
+        self.cmd = None             # next beat's command, with a synth
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+        # number of clicks started, and buffers generated
+        self.num_clicks = 0
+        self.num_buffers = 0
+
+    # num beats per bar, each beat a 1/den note. Takes effect at the next
+    # beat, which becomes the first beat of a bar. With a synth, the next
+    # note on is still a whole old beat away; the new beat length applies
+    # from there on, and there are no accents to restart.
+    def set_time_signature(self, num, den = 4):
+        # the next beat's tick, before beat_len changes under it
+        tick = self._beat_tick(self.next_beat)
+        self.num_beats = num
+        self.beat_len = kTicksPerQuarter * 4 // den
+        if self.playing and not self.synth:
+            self._set_origin(tick)
 
     def start(self):
         if self.playing:
@@ -31,26 +93,26 @@ class Metronome(object):
 
         self.playing = True
 
-        # set up the correct sound (program: bank and preset)
-        self.synth.program(self.channel, self.program[0], self.program[1])
+        if self.synth:
+            self._start_synth()
+            return
+
+        # this generator's clock follows the scheduler's from here on
+        self.frame = int(round(self.sched.get_time() * Audio.sample_rate))
 
         # find the tick of the next beat, and make it "beat aligned"
         now = self.sched.get_tick()
-        next_beat = quantize_tick_up(now, 480)
-
-        # now, post the _noteon function (and remember this command)
-        self.cmd = self.sched.post_at_tick(self._noteon, next_beat)
+        self._set_origin(quantize_tick_up(now, self.beat_len))
 
     def stop(self):
         if not self.playing:
-            return 
-            
+            return
+
+        # clicks already started ring out
         self.playing = False
 
         # cancel anything pending in the future.
         self.sched.remove(self.cmd)
-
-        # reset these so we don't have a reference to old commands.
         self.cmd = None
 
     def toggle(self):
@@ -59,20 +121,105 @@ class Metronome(object):
         else:
             self.start()
 
+    # the returned buffer is reused, so it is only valid until the next call
+    def generate(self, num_frames, num_channels):
+        num_samples = num_frames * num_channels
+        if len(self.buffer) < num_samples:
+            self.buffer = np.zeros(num_samples, dtype=np.float32)
+        output = self.buffer[:num_samples]
+        output.fill(0)
+
+        end_frame = self.frame + num_frames
+
+        # start every click whose beat falls in this buffer
+        if self.playing and not self.synth:
+            if self.next_frame is None or self.version != getattr(self.tempo_map, 'version', None):
+                self._update_next_frame()
+            while self.next_frame < end_frame:
+                is_accent = self.next_beat % self.num_beats == 0
+                self.sounding.append((self.next_frame, self.accent if is_accent else self.click))
+                self.num_clicks += 1
+                self.next_beat += 1
+                self._update_next_frame()
+
+        # mix in each sounding click, from wherever it is up to
+        if self.sounding:
+            frames = output.reshape(num_frames, num_channels)
+            for start, click in self.sounding:
+                begin = max(start - self.frame, 0)
+                end = min(start + len(click) - self.frame, num_frames)
+                if end > begin:
+                    frames[begin:end] += click[begin + self.frame - start:end + self.frame - start, np.newaxis]
+
+            # all clicks are the same length, so the oldest ones end first
+            while self.sounding and self.sounding[0][0] + len(self.sounding[0][1]) <= end_frame:
+                self.sounding.popleft()
+
+        self.frame = end_frame
+        self.num_buffers += 1
+        return output, True
+
+    def _set_origin(self, tick):
+        self.origin = tick
+        self.next_beat = 0
+        self.next_frame = None
+
+    def _beat_tick(self, beat):
+        return self.origin + beat * self.beat_len
+
+    def _update_next_frame(self):
+        time = self.tempo_map.tick_to_time(self._beat_tick(self.next_beat))
+        self.next_frame = int(time * Audio.sample_rate)
+        self.version = getattr(self.tempo_map, 'version', None)
+
+    # the original synth-driven metronome: a note every beat
+    def _start_synth(self):
+        # set up the correct sound (program: bank and preset)
+        self.synth.program(self.channel, self.program[0], self.program[1])
+
+        # find the tick of the next beat, and make it "beat aligned"
+        now = self.sched.get_tick()
+        next_beat = quantize_tick_up(now, self.beat_len)
+        self.cmd = self.sched.post_at_tick(self._noteon, next_beat)
+
     def _noteon(self, tick, ignore):
-        # play the note right now:
         pitch = 60
         vel = 100
         self.synth.noteon(self.channel, pitch, vel)
 
-        # post the note off for half a beat later:
-        off_tick = tick + 240
-        self.sched.post_at_tick(self._noteoff, off_tick, pitch)
-
-        # schedule the next noteon for one beat later
-        next_beat = tick + 480
-        self.cmd = self.sched.post_at_tick(self._noteon, next_beat)
+        # note off half a beat later, next note one beat later
+        self.sched.post_at_tick(self._noteoff, tick + self.beat_len // 2, pitch)
+        self.cmd = self.sched.post_at_tick(self._noteon, tick + self.beat_len)
 
     def _noteoff(self, tick, pitch):
-        # just turn off the currently sounding note.
         self.synth.noteoff(self.channel, pitch)
+
+
+# benchmark: cost of generating buffers with the metronome running, against
+# the same buffers with it stopped (clicks mixed vs nothing to do).
+# Run with: python -m common.metro
+if __name__ == "__main__":
+    import time
+    from .clock import AudioScheduler, SimpleTempoMap
+
+    num_buffers = 20000
+    for bpm in (120, 480):
+        sched = AudioScheduler(SimpleTempoMap(bpm))
+        metro = Metronome(sched, num_beats = 3)
+        timings = []
+        for playing in (False, True):
+            if playing:
+                metro.start()
+            t = time.perf_counter()
+            for i in range(num_buffers):
+                sched.generate(Audio.buffer_size, 2)
+                metro.generate(Audio.buffer_size, 2)
+            timings.append(time.perf_counter() - t)
+            if playing:
+                # check the clicks were mixed in
+                assert metro.num_clicks > 0
+
+        per_buffer = 1e6 * (timings[1] - timings[0]) / num_buffers
+        per_beat = 1e6 * (timings[1] - timings[0]) / metro.num_clicks
+        print('%d bpm: %d beats, %.2fus extra per buffer, %.2fus per beat' %
+              (bpm, metro.num_clicks, per_buffer, per_beat))
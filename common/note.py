@@ -19,6 +19,93 @@ kTRT = pow(2.0, 1.0/12.0)
 def midi_to_frequency(n) :
     return 440.0 * pow(kTRT, (n - 69))
 
+# harmonic series of each timbre: (function, amplitude of each harmonic)
+kHarmonics = {
+    "sine": (np.sin, (1., )),
+    "square": (np.sin, (1., 0, 1/3., 0, 1/5., 0, 1/7., 0, 1/9.)),
+    "sawtooth": (np.sin, (1., -1/2., 1/3., -1/4., 1/5., -1/6., 1/7., -1/8., 1/9.)),
+    "triangle": (np.cos, (1., 0, 1/9., 0, 1/25., 0, 1/49.)),
+}
+
+# number of samples in one cycle of a wavetable (a power of 2)
+kWavetableBits = 11
+kWavetableSize = 1 << kWavetableBits
+
+# Oscillator phase is a uint32 fixed-point accumulator where 2**32 is one full
+# cycle, so it wraps around by itself. The top kWavetableBits select the table
+# sample and the remaining bits are the fraction used for interpolation.
+kFracBits = 32 - kWavetableBits
+kFracMask = (1 << kFracBits) - 1
+
+# Wavetables are computed once and shared. For each timbre there is one table
+# per number of harmonics, so a note only uses the harmonics that fall below
+# Nyquist at its frequency (ie, the tables are band-limited). All tables are
+# stacked into one 2D array so that many notes can be looked up in one call.
+g_wavetables = None
+g_wavetable_rows = {}
+
+def get_wavetables() :
+    global g_wavetables
+    if g_wavetables is None:
+        # one extra guard sample at the end so interpolation never wraps
+        phase = np.arange(kWavetableSize + 1) * (2.0 * np.pi / kWavetableSize)
+        rows = []
+        for timbre, (func, weights) in kHarmonics.items():
+            table = np.zeros(kWavetableSize + 1)
+            for (h, w) in enumerate(weights):
+                if w != 0:
+                    table += w * func(phase * (h+1))
+                g_wavetable_rows[(timbre, h+1)] = len(rows)
+                rows.append(table.copy())
+        g_wavetables = np.array(rows, dtype=np.float32)
+    return g_wavetables
+
+# row of get_wavetables() to use for a given timbre and frequency
+def get_wavetable_row(timbre, freq) :
+    get_wavetables()
+    weights = kHarmonics[timbre][1]
+    num_harmonics = int(0.5 * Audio.sample_rate / freq)
+    num_harmonics = int(np.clip(num_harmonics, 1, len(weights)))
+    return g_wavetable_rows[(timbre, num_harmonics)]
+
+# fixed-point phase increment per frame for a frequency
+def frequency_to_phase_inc(freq) :
+    return np.uint32(round(freq * (1 << 32) / Audio.sample_rate) & 0xFFFFFFFF)
+
+# uint32 phases for num_frames frames starting at phase, one row per voice if
+# phase and phase_inc are arrays. Overflow wraps, which is exactly one cycle.
+def advance_phase(phase, phase_inc, num_frames) :
+    ramp = get_ramp(num_frames)
+    pos = np.multiply.outer(phase_inc, ramp)
+    pos += np.asarray(phase)[..., np.newaxis]
+    return pos
+
+# linearly interpolated lookup of table at fixed-point phases. offset is added
+# to the table index, to select a row of the flattened 2D wavetable array.
+def wavetable_lookup(table, phase, offset=0) :
+    idx = (phase >> kFracBits).astype(np.intp)
+    idx += offset
+    frac = (phase & kFracMask).astype(np.float32)
+    frac *= 1.0 / (1 << kFracBits)
+
+    a = np.take(table, idx)
+    idx += 1
+    b = np.take(table, idx)
+    b -= a
+    b *= frac
+    b += a
+    return b
+
+# shared ramp 0, 1, 2, ... used to advance oscillator phase over a buffer
+g_ramp = np.arange(0, dtype=np.uint32)
+
+def get_ramp(num_frames) :
+    global g_ramp
+    if len(g_ramp) < num_frames:
+        g_ramp = np.arange(num_frames, dtype=np.uint32)
+    return g_ramp[:num_frames]
+
+
 class NoteGenerator(object):
     def __init__(self, pitch, gain, timbre="sine"):
         super(NoteGenerator, self).__init__()
@@ -28,53 +115,131 @@ class NoteGenerator(object):
         self.frame = 0
         self.playing = True
 
-        harmonics = {
-            "sine": (np.sin, (1., )),
-            "square": (np.sin, (1., 0, 1/3., 0, 1/5., 0, 1/7., 0, 1/9.)),
-            "sawtooth": (np.sin, (1., -1/2., 1/3., -1/4., 1/5., -1/6., 1/7., -1/8., 1/9.)),
-            "triangle": (np.cos, (1., 0, 1/9., 0, 1/25., 0, 1/49.)),
-        }
-
-        self.func = harmonics[timbre][0]
-        self.harmonics = harmonics[timbre][1]
+        # band-limited wavetable and phase accumulator
+        self.table = get_wavetables()[get_wavetable_row(timbre, self.freq)]
+        self.phase = np.uint32(0)
+        self.phase_inc = frequency_to_phase_inc(self.freq)
 
     def note_off(self):
         self.playing = False
 
     def generate(self, num_frames, num_channels) :
-        # create time series from frame range
-        time = np.arange(self.frame, self.frame + num_frames) / Audio.sample_rate 
-
-        # frequency
-        omega = (2.0 * np.pi) * self.freq
+        # phases for this buffer, continuing from the last one
+        phase = advance_phase(self.phase, self.phase_inc, num_frames)
 
         # final output, gain
-        output = self.gain * self.make_waveform(omega * time)
+        output = wavetable_lookup(self.table, phase)
+        output *= self.gain
 
-        # advance frame counter
+        # advance frame counter and phase
         self.frame += num_frames
+        self.phase = np.uint32((int(phase[-1]) + int(self.phase_inc)) & 0xFFFFFFFF)
 
         # convert from mono to stereo
         if num_channels == 2:
-            stereo = np.empty(num_frames * 2)
-            stereo[0::2] = output
-            stereo[1::2] = output
-            output = stereo
+            output = np.repeat(output, 2)
 
         return (output, self.playing)
 
-    def make_waveform(self, time) :
-        # create fundamental frequency
-        signal = self.harmonics[0] * self.func( time )
-
-        # add additional harmonics
-        for (h, w) in enumerate( self.harmonics[1:] ):
-            if w != 0: # optimization for amplitude weight = 0
-                signal += w * self.func( time * (h+2))
-
-        return signal
 
+# Renders many simultaneous notes as one 2D NumPy batch instead of one
+# NoteGenerator object per voice. Voices are slots in preallocated arrays;
+# note_on() returns the slot, which is passed to note_off() to stop it.
+class OscillatorBank(object):
+    def __init__(self, max_voices=256):
+        super(OscillatorBank, self).__init__()
+        self.tables = get_wavetables().ravel()
+        self.row_len = kWavetableSize + 1
+
+        self.active = np.zeros(max_voices, dtype=bool)
+        self.phase = np.zeros(max_voices, dtype=np.uint32)
+        self.phase_inc = np.zeros(max_voices, dtype=np.uint32)
+        self.gain = np.zeros(max_voices, dtype=np.float32)
+        self.offset = np.zeros(max_voices, dtype=np.intp)
+
+        self.output = np.zeros(0, dtype=np.float32)
+
+    def note_on(self, pitch, gain, timbre="sine") :
+        free = np.flatnonzero(~self.active)
+        if len(free) == 0:
+            self._grow()
+            free = np.flatnonzero(~self.active)
+        v = free[0]
+
+        freq = midi_to_frequency(pitch)
+        self.active[v] = True
+        self.phase[v] = 0
+        self.phase_inc[v] = frequency_to_phase_inc(freq)
+        self.gain[v] = gain
+        self.offset[v] = get_wavetable_row(timbre, freq) * self.row_len
+        return v
+
+    def note_off(self, voice) :
+        self.active[voice] = False
+
+    def get_num_active(self) :
+        return int(np.count_nonzero(self.active))
 
+    def generate(self, num_frames, num_channels) :
+        num_samples = num_frames * num_channels
+        if len(self.output) < num_samples:
+            self.output = np.zeros(num_samples, dtype=np.float32)
+        output = self.output[:num_samples]
+
+        voices = np.flatnonzero(self.active)
+        if len(voices) == 0:
+            output.fill(0)
+            return (output, True)
+
+        # (voices x frames) matrix of phases, looked up all at once
+        phase_inc = self.phase_inc[voices]
+        phase = advance_phase(self.phase[voices], phase_inc, num_frames)
+        samples = wavetable_lookup(self.tables, phase, self.offset[voices, np.newaxis])
+
+        # weighted sum of all voices
+        mono = self.gain[voices] @ samples
+
+        self.phase[voices] = phase[:, -1] + phase_inc
+
+        for c in range(num_channels):
+            output[c::num_channels] = mono
+        return (output, True)
+
+    def _grow(self) :
+        n = len(self.active)
+        self.active = np.append(self.active, np.zeros(n, dtype=bool))
+        self.phase = np.append(self.phase, np.zeros(n, dtype=np.uint32))
+        self.phase_inc = np.append(self.phase_inc, np.zeros(n, dtype=np.uint32))
+        self.gain = np.append(self.gain, np.zeros(n, dtype=np.float32))
+        self.offset = np.append(self.offset, np.zeros(n, dtype=np.intp))
+
+
+# Envelope curves are computed once per (num_frames, exponent) and shared.
+# A rising curve goes from 0 towards 1 as (x ** 1/n), a falling curve from 1
+# towards 0 as (1 - x ** 1/n), where x goes from 0 to 1 over num_frames.
+g_env_curves = {}
+
+def get_env_curve(num_frames, exponent, rising) :
+    key = (num_frames, exponent, rising)
+    if key not in g_env_curves:
+        curve = (np.arange(num_frames) / max(num_frames, 1)) ** (1.0/exponent)
+        if not rising:
+            curve = 1.0 - curve
+        g_env_curves[key] = curve.astype(np.float32)
+    return g_env_curves[key]
+
+
+# the first n samples of obj.buffer, grown (float32) if needed
+def get_scratch(obj, n) :
+    if len(obj.buffer) < n:
+        obj.buffer = np.zeros(n, dtype=np.float32)
+    return obj.buffer[:n]
+
+
+# Envelope and ADSREnvelope write the enveloped signal into a buffer of their
+# own and never change the wrapped generator's output, which may be shared (eg,
+# a WaveBuffer slice of a cached file). The returned buffer is reused, so it is
+# only valid until the next call.
 class Envelope(object):
     #  Total duration is attack_time + decay_time
     def __init__(self, generator, attack_time, n1, decay_time, n2):
@@ -89,45 +254,163 @@ class Envelope(object):
         # attack / decay envelope shapes
         self.n1 = n1
         self.n2 = n2
+        self.attack = get_env_curve(self.attack_frames, n1, True)
+        self.decay = get_env_curve(self.decay_frames, n2, False)
 
         self.frame = 0
+        self.buffer = np.zeros(0, dtype=np.float32)
 
     def generate(self, num_frames, num_channels) :
         # get data from predecessor:
         data, continue_flag = self.generator.generate(num_frames, num_channels)
+        output = get_scratch(self, len(data))
+
+        # one row per frame, so a slice of a curve scales all channels
+        src = np.reshape(data, (-1, num_channels))
+        frames = output.reshape(-1, num_channels)
 
         # set up correct frame ranges:
         end_frame = self.frame + num_frames
-        frames = np.arange(self.frame, end_frame)
-
-        # boundary is the transition location between attack and decay functions
-        boundary = int(np.clip(self.attack_frames - self.frame, 0, num_frames))
+        af = self.attack_frames
+        df = self.decay_frames
 
         # attack part:
-        env1 = (frames[:boundary] / self.attack_frames) ** (1.0/self.n1)
+        start = min(self.frame, af)
+        stop = min(end_frame, af)
+        if stop > start:
+            np.multiply(src[:stop - start], self.attack[start:stop, np.newaxis],
+                        out=frames[:stop - start])
 
         # decay part:
-        env2 = 1.0 - ((frames[boundary:] - self.attack_frames) / self.decay_frames) ** (1.0/self.n2)
-
-        # combine:
-        env = np.append(env1, env2)
+        offset = max(af - self.frame, 0)
+        start = max(self.frame - af, 0)
+        stop = min(end_frame - af, df)
+        if stop > start:
+            np.multiply(src[offset:offset + stop - start], self.decay[start:stop, np.newaxis],
+                        out=frames[offset:offset + stop - start])
 
         # deal with end of envelope:
-        # clamp curve to 0, so we don't get any negative values and don't continue
-        if end_frame > self.attack_frames + self.decay_frames:
-            env[env < 0] = 0
+        # silence anything past the end, and don't continue
+        if end_frame > af + df:
+            frames[max(af + df - self.frame, 0):] = 0
             continue_flag = False
 
         # advance frame counter
         self.frame = end_frame
 
-        # make envelope work for stereo if needed
-        if num_channels == 2:
-            stereo = np.empty(num_frames * 2)
-            stereo[0::2] = env
-            stereo[1::2] = env
-            env = stereo
-            
-        output = env * data
         return output, continue_flag
 
+
+# Attack / Decay / Sustain / Release envelope. The note holds at the sustain
+# level (without any per-buffer curve evaluation) until note_off() is called,
+# then fades out over release_time.
+class ADSREnvelope(object):
+    def __init__(self, generator, attack_time, decay_time, sustain, release_time, n1=1, n2=1):
+        super(ADSREnvelope, self).__init__()
+
+        self.generator = generator
+        self.sustain = float(sustain)
+
+        # stage curves. Their lengths are the stage lengths in frames
+        self.attack = get_env_curve(round(attack_time * Audio.sample_rate), n1, True)
+        self.decay = get_env_curve(round(decay_time * Audio.sample_rate), n2, False)
+        self.release = get_env_curve(round(release_time * Audio.sample_rate), n2, False)
+
+        self.stage = 'attack'
+        self.stage_frame = 0
+        self.level = 0.0
+        self.release_level = 0.0
+
+        # preallocated envelope and output for one buffer
+        self.env = np.zeros(0, dtype=np.float32)
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+    def note_off(self) :
+        if self.stage != 'release' and self.stage != 'done':
+            self.release_level = self.level
+            self.stage = 'release'
+            self.stage_frame = 0
+
+    def generate(self, num_frames, num_channels) :
+        data, continue_flag = self.generator.generate(num_frames, num_channels)
+
+        if len(self.env) < num_frames:
+            self.env = np.zeros(num_frames, dtype=np.float32)
+        env = self.env[:num_frames]
+
+        # fill env stage by stage. A stage may end part way through the buffer
+        i = 0
+        while i < num_frames:
+            if self.stage == 'attack':
+                i = self._fill(env, i, self.attack, 1.0, 0.0, 'decay')
+            elif self.stage == 'decay':
+                # falls from 1 to sustain
+                i = self._fill(env, i, self.decay, 1.0 - self.sustain, self.sustain, 'sustain')
+            elif self.stage == 'sustain':
+                env[i:] = self.sustain
+                i = num_frames
+            elif self.stage == 'release':
+                i = self._fill(env, i, self.release, self.release_level, 0.0, 'done')
+            else:
+                env[i:] = 0
+                i = num_frames
+
+        if self.stage == 'done':
+            continue_flag = False
+        if num_frames:
+            self.level = env[-1]
+
+        output = get_scratch(self, len(data))
+        np.multiply(np.reshape(data, (-1, num_channels)), env[:len(data) // num_channels, np.newaxis],
+                    out=output.reshape(-1, num_channels))
+        return output, continue_flag
+
+    # write scale * curve + bias into env starting at i, for as much of the
+    # current stage as fits. Moves on to next_stage at the end of the curve.
+    def _fill(self, env, i, curve, scale, bias, next_stage) :
+        num = min(len(env) - i, len(curve) - self.stage_frame)
+        out = env[i:i + num]
+        np.multiply(curve[self.stage_frame:self.stage_frame + num], scale, out=out)
+        out += bias
+
+        self.stage_frame += num
+        if self.stage_frame == len(curve):
+            self.stage = next_stage
+            self.stage_frame = 0
+        return i + num
+
+
+# benchmark: time to render 256 notes in one buffer, with NoteGenerators in a
+# Mixer and with an OscillatorBank.
+# Run with: python -m common.note
+if __name__ == "__main__":
+    import time
+    from .mixer import Mixer
+
+    num_frames = Audio.buffer_size
+    period = num_frames / float(Audio.sample_rate)
+    reps = 50
+    timbres = list(kHarmonics.keys())
+
+    for num_notes in (16, 64, 256, 512):
+        mixer = Mixer()
+        bank = OscillatorBank()
+        for i in range(num_notes):
+            timbre = timbres[i % len(timbres)]
+            mixer.add(NoteGenerator(40 + i % 60, 0.1, timbre))
+            bank.note_on(40 + i % 60, 0.1, timbre)
+
+        t = time.perf_counter()
+        for i in range(reps):
+            mixer.generate(num_frames, 2)
+        t_gen = (time.perf_counter() - t) / reps
+
+        t = time.perf_counter()
+        for i in range(reps):
+            bank.generate(num_frames, 2)
+        t_bank = (time.perf_counter() - t) / reps
+
+        print(
+            "%3d notes: NoteGenerators %.2f ms, OscillatorBank %.2f ms (buffer period %.2f ms)"
+            % (num_notes, 1000 * t_gen, 1000 * t_bank, 1000 * period)
+        )
@@ -8,27 +8,181 @@
 #
 #####################################################################
 
+import os
+import time
 import numpy as np
 from . import fluidsynth
 from .audio import Audio
 
+# Synths created through get_synth(), one per soundfont file. Parsing a large
+# soundfont (like General MIDI) takes a long time, so everyone that asks for
+# the same file shares one synth and one loaded soundfont.
+g_synths = {}
+
+def get_synth(filepath, gain = 0.8, lazy = True):
+    key = os.path.abspath(filepath)
+    if key not in g_synths:
+        g_synths[key] = Synth(filepath, gain, lazy)
+    return g_synths[key]
+
+
 # create another kind of generator that generates audio based on the fluid
 # synth synthesizer
+#
+# If lazy is True, the samples of a preset are only loaded when that preset is
+# first selected on a channel (see program()), so only the presets actually
+# used are ever loaded.
+#
+# In event queue mode (see start_event_queue()), note on/off, cc and program
+# calls made while an event offset is set are not applied right away. They are
+# queued on a FluidSynth sequencer, timestamped at that frame offset into the
+# next rendered block, and FluidSynth applies them while rendering the whole
+# block in a single call.
 class Synth(fluidsynth.Synth, object):
-    def __init__(self, filepath, gain = 0.8):
-        super(Synth, self).__init__(gain, samplerate=Audio.sample_rate)
-        self.sfid = self.sfload(filepath)
-        if self.sfid == -1:
-            raise Exception('Error in fluidsynth.sfload(): cannot open ' + filepath)
+    def __init__(self, filepath, gain = 0.8, lazy = False):
+        settings = {'synth.dynamic-sample-loading': 1} if lazy else {}
+        super(Synth, self).__init__(gain, samplerate=Audio.sample_rate, **settings)
+
+        # event queue mode. Set before anything below calls program(), which
+        # checks event_time
+        self.sequencer = None
+        self.seq_dest = None
+        self.event_time = None
+        self.queue_start = 0     # frames_rendered when the sequencer started
+
+        # number of render calls and frames rendered so far
+        self.num_renders = 0
+        self.frames_rendered = 0
+
+        self.sfids = {}
+        self.load_times = {}
+        self.sfid = self.load_soundfont(filepath)
         self.program(0, 0, 0)
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+    # load a soundfont into this synth, or return its sfid if already loaded
+    def load_soundfont(self, filepath):
+        key = os.path.abspath(filepath)
+        if key not in self.sfids:
+            t = time.perf_counter()
+            sfid = self.sfload(filepath)
+            if sfid == -1:
+                raise Exception('Error in fluidsynth.sfload(): cannot open ' + filepath)
+            self.sfids[key] = sfid
+            self.load_times[key] = time.perf_counter() - t
+        return self.sfids[key]
 
     def program(self, chan, bank, preset):
         self.program_select(chan, self.sfid, bank, preset)
 
+    # switch to event queue mode. The sequencer runs on the synth's own sample
+    # clock (one sequencer tick per frame) and advances as blocks render, so
+    # events land with FluidSynth's internal block accuracy (64 frames). The
+    # sequencer's clock starts at 0 here, not when the synth was created
+    def start_event_queue(self):
+        if self.sequencer is None:
+            self.queue_start = self.frames_rendered
+            self.sequencer = fluidsynth.Sequencer(time_scale=Audio.sample_rate,
+                                                  use_system_timer=False)
+            self.seq_dest = self.sequencer.register_fluidsynth(self)
+
+    # calls made after this are queued offset frames into the next block. Set
+    # to None to go back to applying calls immediately.
+    def set_event_offset(self, offset):
+        if self.sequencer is None or offset is None:
+            self.event_time = None
+        else:
+            self.event_time = self.frames_rendered - self.queue_start + max(offset, 0)
+
+    def noteon(self, chan, key, vel):
+        if self.event_time is None:
+            return super(Synth, self).noteon(chan, key, vel)
+        self.sequencer.note_on(self.event_time, chan, key, vel, dest=self.seq_dest)
+
+    def noteoff(self, chan, key):
+        if self.event_time is None:
+            return super(Synth, self).noteoff(chan, key)
+        self.sequencer.note_off(self.event_time, chan, key, dest=self.seq_dest)
+
+    def cc(self, chan, ctrl, val):
+        if self.event_time is None:
+            return super(Synth, self).cc(chan, ctrl, val)
+        self.sequencer.control_change(self.event_time, chan, ctrl, val, dest=self.seq_dest)
+
+    def program_select(self, chan, sfid, bank, preset):
+        if self.event_time is None:
+            return super(Synth, self).program_select(chan, sfid, bank, preset)
+        self.sequencer.program_select(self.event_time, chan, sfid, bank, preset, dest=self.seq_dest)
+
+    # render len(out) / 2 frames of float samples straight into out, a float32
+    # array owned by the caller. Interleaved stereo, or if interleaved is
+    # False, an array of shape (2, num_frames) holding left then right.
+    def render(self, out, interleaved = True):
+        self.write_float(out, interleaved)
+        self.num_renders += 1
+        self.frames_rendered += out.size // 2
+        return out
+
+    # the output buffer is reused, so it is only valid until the next call
     def generate(self, num_frames, num_channels):
         assert(num_channels == 2)
-        # get_samples() returns interleaved stereo, so all we have to do is scale
-        # the data to [-1, 1].
-        samples = self.get_samples(num_frames).astype(np.float32)
+        if len(self.buffer) < num_frames * 2:
+            self.buffer = np.zeros(num_frames * 2, dtype=np.float32)
+        return (self.render(self.buffer[:num_frames * 2]), True)
+
+
+# benchmarks:
+# - soundfont load time, eager and lazy, and time to first note (select the
+#   preset, note on, render one buffer) for the presets the puzzles use
+# - the previous s16 path (write s16, copy, convert, scale) against rendering
+#   floats directly into a preallocated buffer.
+# Run with: python -m common.synth
+if __name__ == "__main__":
+    sf_path = './data/FluidR3_GM.sf2'
+
+    presets = (('piano', 0, 0), ('guitar', 0, 24), ('bass', 0, 33), ('drums', 128, 0))
+    for lazy in (False, True):
+        synth = Synth(sf_path, lazy=lazy)
+        print("%s load: %.1fms" % ('lazy' if lazy else 'eager',
+                                  1000 * synth.load_times[os.path.abspath(sf_path)]))
+        for chan, (name, bank, preset) in enumerate(presets, 1):
+            t = time.perf_counter()
+            synth.program(chan, bank, preset)
+            synth.noteon(chan, 60, 100)
+            synth.generate(512, 2)
+            print("  %-6s first note: %.1fms" % (name, 1000 * (time.perf_counter() - t)))
+        synth.delete()
+
+    synth = get_synth(sf_path)
+    assert get_synth(sf_path) is synth
+    for pitch in (48, 55, 60, 64, 67, 72):
+        synth.noteon(0, pitch, 100)
+
+    def s16_path(num_frames):
+        samples = synth.get_samples(num_frames).astype(np.float32)
         samples *= (1.0/32768.0)
-        return (samples, True)
+        return samples
+
+    split = np.zeros((2, 4096), dtype=np.float32)
+    total_frames = Audio.sample_rate * 10
+    for num_frames in (64, 128, 256, 512, 1024, 2048, 4096):
+        reps = total_frames // num_frames
+        t = time.perf_counter()
+        for i in range(reps):
+            s16_path(num_frames)
+        t_s16 = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for i in range(reps):
+            synth.generate(num_frames, 2)
+        t_float = time.perf_counter() - t
+
+        out = split[:, :num_frames].copy()
+        t = time.perf_counter()
+        for i in range(reps):
+            synth.render(out, interleaved=False)
+        t_split = time.perf_counter() - t
+
+        us = 1e6 / reps
+        print("%4d frames: s16 %7.1fus  float %7.1fus  float split %7.1fus per buffer" %
+              (num_frames, t_s16 * us, t_float * us, t_split * us))
@@ -9,7 +9,10 @@
 #####################################################################
 
 import numpy as np
+import struct
+import time
 import wave
+from collections import OrderedDict
 from .audio import Audio
 
 # Interface for reading data from a wave file. Does not store this data locally.
@@ -34,7 +37,7 @@ class WaveFile(object):
         raw_bytes = self.wave.readframes(end_frame - start_frame)
 
         # convert raw data to numpy array, assuming int16 arrangement
-        samples = np.fromstring(raw_bytes, dtype = np.int16)
+        samples = np.frombuffer(raw_bytes, dtype = np.int16)
 
         # convert from integer type to floating point, and scale to [-1, 1]
         samples = samples.astype(np.float32)
@@ -45,6 +48,165 @@ class WaveFile(object):
     def get_num_channels(self):
         return self.num_channels
 
+    def get_num_frames(self):
+        return self.end
+
+# Same interface as WaveFile, but the file is memory-mapped instead of being
+# read with a syscall on every buffer. The RIFF header is parsed once and the
+# sample data is exposed as an int16 np.memmap view. get_frames() converts only
+# the requested slice, into a float32 buffer that is reused from call to call,
+# so the returned array is only valid until the next get_frames() call.
+class MappedWaveFile(object):
+    def __init__(self, filepath) :
+        super(MappedWaveFile, self).__init__()
+
+        data_offset, data_size = self._parse_header(filepath)
+
+        # for now, we will only accept 16 bit files and the sample rate must match
+        assert(self.sampwidth == 2)
+        assert(self.sr == Audio.sample_rate)
+
+        self.end = data_size // (self.sampwidth * self.num_channels)
+        self.samples = np.memmap(filepath, dtype='<i2', mode='r', offset=data_offset,
+                                 shape=(self.end * self.num_channels,))
+        self.buffer = np.zeros(0, dtype=np.float32)
+
+    def _parse_header(self, filepath) :
+        with open(filepath, 'rb') as f:
+            riff, size, wave_id = struct.unpack('<4sI4s', f.read(12))
+            assert riff == b'RIFF' and wave_id == b'WAVE', filepath + ' is not a wave file'
+
+            # walk the chunks until the data chunk. fmt comes before data.
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(filepath + ' has no data chunk')
+                chunk_id, chunk_size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack('<HHIIHH', f.read(16))
+                    f.seek(chunk_size - 16, 1)
+                    assert fmt[0] == 1, 'only PCM wave files are supported'
+                    self.num_channels = fmt[1]
+                    self.sr = fmt[2]
+                    self.sampwidth = fmt[5] // 8
+                elif chunk_id == b'data':
+                    return f.tell(), chunk_size
+                else:
+                    # chunks are padded to an even size
+                    f.seek(chunk_size + (chunk_size & 1), 1)
+
+    # read an arbitrary chunk of data from the file. If asking for more than
+    # is available, returns what it can
+    def get_frames(self, start_frame, end_frame) :
+        end_frame = min(end_frame, self.end)
+        start_frame = min(start_frame, end_frame)
+        out = self._get_buffer((end_frame - start_frame) * self.num_channels)
+        self._convert(start_frame, end_frame, out)
+        return out
+
+    # read num_frames starting at start_frame, wrapping from loop_end back to
+    # loop_start as many times as needed. Always returns num_frames frames.
+    def get_frames_looped(self, start_frame, num_frames, loop_start=0, loop_end=None) :
+        if loop_end is None:
+            loop_end = self.end
+        assert(loop_start < loop_end)
+        out = self._get_buffer(num_frames * self.num_channels)
+
+        frame = start_frame
+        o_idx = 0
+        while o_idx < len(out):
+            if frame >= loop_end:
+                frame = loop_start
+            n = min(loop_end - frame, (len(out) - o_idx) // self.num_channels)
+            self._convert(frame, frame + n, out[o_idx : o_idx + n * self.num_channels])
+            o_idx += n * self.num_channels
+            frame += n
+        return out
+
+    def get_num_channels(self):
+        return self.num_channels
+
+    def get_num_frames(self):
+        return self.end
+
+    def _get_buffer(self, num_samples) :
+        if len(self.buffer) < num_samples:
+            self.buffer = np.zeros(num_samples, dtype=np.float32)
+        return self.buffer[:num_samples]
+
+    # convert frames [start_frame, end_frame) to float32 in [-1, 1], into out
+    def _convert(self, start_frame, end_frame, out) :
+        out[:] = self.samples[start_frame * self.num_channels : end_frame * self.num_channels]
+        out *= (1 / 32768.0)
+
+
+# Decoded wave files, kept in memory so that each file is only read and
+# decoded once no matter how many WaveBuffers use it. Holds at most
+# max_bytes of decoded audio, dropping the least recently used files first.
+# (Buffers that still reference a dropped file keep their data alive.)
+class SampleCache(object):
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        super(SampleCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.files = OrderedDict()
+
+        # load statistics. cold = decoded from disk, warm = already cached
+        self.num_cold = 0
+        self.num_warm = 0
+        self.cold_time = 0
+        self.warm_time = 0
+
+    # returns (data, num_channels) for the whole file. data is float32 and
+    # read-only, since everyone using the file shares it.
+    def get(self, filepath):
+        t_start = time.perf_counter()
+
+        if filepath in self.files:
+            self.files.move_to_end(filepath)
+            entry = self.files[filepath]
+            self.num_warm += 1
+            self.warm_time += time.perf_counter() - t_start
+            return entry
+
+        wr = WaveFile(filepath)
+        data = wr.get_frames(0, wr.end)
+        data.flags.writeable = False
+        entry = (data, wr.get_num_channels())
+        wr.wave.close()
+
+        self.files[filepath] = entry
+        self.num_bytes += entry[0].nbytes
+        while self.num_bytes > self.max_bytes and len(self.files) > 1:
+            path, (data, num_channels) = self.files.popitem(last=False)
+            self.num_bytes -= data.nbytes
+
+        self.num_cold += 1
+        self.cold_time += time.perf_counter() - t_start
+        return entry
+
+    # load a list of files ahead of time (eg, during a room transition)
+    def preload(self, filepaths):
+        for path in filepaths:
+            self.get(path)
+
+    def clear(self):
+        self.files.clear()
+        self.num_bytes = 0
+
+    def get_stats(self):
+        return {
+            'files': len(self.files),
+            'bytes': self.num_bytes,
+            'cold_loads': self.num_cold,
+            'cold_time': self.cold_time,
+            'warm_loads': self.num_warm,
+            'warm_time': self.warm_time,
+        }
+
+g_sample_cache = SampleCache()
+
+
 # We can generalize the thing that WaveFile does - it provides arbitrary wave
 # data. We can define a "wave data providing interface" (called WaveSource)
 # if it can support the function:
@@ -53,14 +215,17 @@ class WaveFile(object):
 #
 # Now create WaveBuffer. Same WaveSource interface, but can take a subset of
 # audio data from a wave file and holds all that data in memory.
+# The data is a view into the file's decoded samples in the SampleCache, so
+# many regions of one file share a single array.
 class WaveBuffer(object):
-    def __init__(self, filepath, start_frame, num_frames):
+    def __init__(self, filepath, start_frame, num_frames, cache=None):
         super(WaveBuffer, self).__init__()
 
-        # get a local copy of the audio data from WaveFile
-        wr = WaveFile(filepath)
-        self.data = wr.get_frames(start_frame, start_frame + num_frames)
-        self.num_channels = wr.get_num_channels()
+        if cache is None:
+            cache = g_sample_cache
+        data, self.num_channels = cache.get(filepath)
+        self.data = data[start_frame * self.num_channels :
+                         (start_frame + num_frames) * self.num_channels]
 
     # start and end args are in units of frames,
     # so take into account num_channels when accessing sample data
@@ -72,6 +237,9 @@ class WaveBuffer(object):
     def get_num_channels(self):
         return self.num_channels
 
+    def get_num_frames(self):
+        return len(self.data) // self.num_channels
+
 
 
 # simple class to hold a region: name, start frame, length (in frames)
@@ -109,10 +277,10 @@ class SongRegions(object):
             self.regions.append(AudioRegion(name, start_f, len_f))
 
 # Reads from a regions file and a wave file to create a bunch of WaveBuffers,
-# one per region.
-def make_wave_buffers(wave_path, regions_path):
+# one per region. The wave file is only loaded once (see SampleCache).
+def make_wave_buffers(wave_path, regions_path, cache=None):
     sr = SongRegions(regions_path)
     buffers = {}
     for r in sr.regions:
-        buffers[r.name] = WaveBuffer(wave_path, r.start, r.len)
+        buffers[r.name] = WaveBuffer(wave_path, r.start, r.len, cache)
     return buffers
@@ -10,23 +10,40 @@
 
 import numpy as np
 import os.path
+import queue
+import struct
+import threading
 import wave
 from .audio import Audio
 
+# AudioWriter captures audio to disk as it arrives. Buffers passed to
+# add_audio() are copied into a bounded queue, and a background thread
+# converts and appends them to the output file, so memory stays constant no
+# matter how long the capture runs and stop() does not have to write a huge
+# file all at once. If the writer thread falls behind by more than
+# max_queued buffers, new buffers are dropped (and counted) rather than
+# blocking the audio thread.
 class AudioWriter(object):
-    def __init__(self, filebase, output_wave=True):
+    def __init__(self, filebase, output_wave=True, max_queued=256):
         super(AudioWriter, self).__init__()
         self.active = False
-        self.buffers = []
         self.filebase = filebase
         self.output_wave = output_wave
+        self.max_queued = max_queued
 
+        self.queue = None
+        self.thread = None
+        self.num_dropped = 0
+
+    # called from the audio thread, possibly while stop() runs on another
     def add_audio(self, data, num_channels) :
-        if self.active:
-            # only use a single channel if we are in stereo
-            if num_channels == 2:
-                data = data[0::2]
-            self.buffers.append(data)
+        q = self.queue
+        if self.active and q is not None:
+            # copy, since generators may reuse their output buffers
+            try:
+                q.put_nowait((np.array(data, dtype=np.float32), num_channels))
+            except queue.Full:
+                self.num_dropped += 1
 
     def toggle(self) :
         if self.active:
@@ -38,25 +55,58 @@ class AudioWriter(object):
         if not self.active:
             print('AudioWriter: start capture')
             self.active = True
-            self.buffers = []
+            self.num_dropped = 0
+            self.queue = queue.Queue(self.max_queued)
+            self.thread = threading.Thread(target=self._write_loop, args=(self.queue,), daemon=True)
+            self.thread.start()
 
     def stop(self) :
         if self.active:
             print('AudioWriter: stop capture')
             self.active = False
+            q, thread = self.queue, self.thread
+            self.queue = None
+            self.thread = None
 
-            output = combine_buffers(self.buffers)
-            if len(output) == 0:
-                print('AudioWriter: empty buffers. Nothing to write')
-                return
+            # let the writer thread drain the queue and close the file. If the
+            # thread has died, nothing is emptying the queue, so don't wait on it
+            while thread.is_alive():
+                try:
+                    q.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            thread.join()
 
-            ext = 'wav' if self.output_wave else 'npy'
-            filename = self._get_filename(ext)
-            print('AudioWriter: saving', len(output), 'samples in', filename)
-            if self.output_wave:
-                write_wave_file(output, 1, filename)
-            else:
-                np.save(filename, output)
+            if self.num_dropped:
+                print('AudioWriter: dropped', self.num_dropped, 'buffers')
+
+    def _write_loop(self, q) :
+        ext = 'wav' if self.output_wave else 'npy'
+        filename = self._get_filename(ext)
+        stream = None
+
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            data, num_channels = item
+
+            # open the file once we know the channel count
+            if stream is None:
+                stream = WaveStream(filename, num_channels) if self.output_wave \
+                    else NpyStream(filename, num_channels)
+            stream.write(data)
+
+        if stream is None or stream.num_frames == 0:
+            print('AudioWriter: empty buffers. Nothing to write')
+            if stream:
+                stream.close()
+                os.remove(filename)
+            return
+
+        stream.close()
+        print('AudioWriter: saved', stream.num_frames, 'frames in', filename)
 
     # look for a filename that does not exist yet.
     def _get_filename(self, ext) :
@@ -68,6 +118,60 @@ class AudioWriter(object):
             else:
                 suffix += 1
 
+
+# Appends float audio to a 16 bit wave file. The RIFF header sizes are
+# patched when the file is closed.
+class WaveStream(object):
+    def __init__(self, filename, num_channels):
+        super(WaveStream, self).__init__()
+        self.num_channels = num_channels
+        self.num_frames = 0
+        self.file = wave.open(filename, 'w')
+        self.file.setnchannels(num_channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(Audio.sample_rate)
+
+    def write(self, data):
+        samples = np.clip(data * (2**15), -2**15, 2**15 - 1).astype(np.int16)
+        self.file.writeframesraw(samples.tobytes())
+        self.num_frames += len(data) // self.num_channels
+
+    def close(self):
+        self.file.close()
+
+
+# Appends float32 audio to a .npy file, shape (num_frames,) for mono or
+# (num_frames, num_channels) otherwise. The header is written with fixed
+# size up front and rewritten with the final shape when the file is closed.
+class NpyStream(object):
+    header_len = 128
+
+    def __init__(self, filename, num_channels):
+        super(NpyStream, self).__init__()
+        self.num_channels = num_channels
+        self.num_frames = 0
+        self.file = open(filename, 'wb')
+        self._write_header()
+
+    def write(self, data):
+        self.file.write(data.astype('<f4').tobytes())
+        self.num_frames += len(data) // self.num_channels
+
+    def close(self):
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+
+    def _write_header(self):
+        shape = (self.num_frames,) if self.num_channels == 1 else (self.num_frames, self.num_channels)
+        header = "{'descr': '<f4', 'fortran_order': False, 'shape': %s, }" % repr(shape)
+
+        # magic (6) + version (2) + header length (2) + header, ending in newline
+        pad = self.header_len - 10 - len(header) - 1
+        header = header + ' ' * pad + '\n'
+        self.file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
 def write_wave_file(buf, num_channels, name):
     f = wave.open(name, 'w')
     f.setnchannels(num_channels)
@@ -75,18 +179,5 @@ def write_wave_file(buf, num_channels, name):
     f.setframerate(Audio.sample_rate)
     buf = buf * (2**15)
     buf = buf.astype(np.int16)
-    f.writeframes(buf.tostring())
-
-# create single buffer from an array of buffers:
-def combine_buffers(buffers):
-    size = 0
-    for b in buffers:
-        size += len(b)
-
-    # create a single output buffer of the right size
-    output = np.empty( size, dtype=np.float32 )
-    f = 0
-    for b in buffers:
-        output[f:f+len(b)] = b
-        f += len(b)
-    return output
+    f.writeframes(buf.tobytes())
+    f.close()
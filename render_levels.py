@@ -0,0 +1,68 @@
+# Renders the reference audio of every piano and drums level to wave files,
+# offline and faster than real time (no sound card needed).
+#
+# usage: python render_levels.py [output_dir]
+import os
+import sys
+
+from common.audio import Audio, OfflineAudio
+from common.clock import AudioScheduler, SimpleTempoMap
+from common.synth import get_synth
+from src.audio_engine import kSoundfontPath
+from src.levels import drums_instruments as instruments
+from src.levels import drums_levels, piano_levels
+from src.puzzle_sound import Note, NoteSequencer
+
+# extra audio after the last note so releases are not cut off
+kTailSeconds = 1.0
+
+
+def render_notes(synth, notes, program, filepath):
+    tempo_map = SimpleTempoMap(120)
+    sched = AudioScheduler(tempo_map)
+    sched.set_generator(synth)
+
+    note_seq = NoteSequencer(sched, synth, channel=1, program=program, notes=notes)
+    note_seq.start()
+
+    # sequence starts on the first beat and runs for the sum of its steps
+    total_ticks = 480
+    for step in notes:
+        step = step if type(step) is list else [step]
+        total_ticks += step[0].get_dur()
+    seconds = tempo_map.tick_to_time(total_ticks) + kTailSeconds
+
+    audio = OfflineAudio(2)
+    audio.set_generator(sched)
+    audio.render_to_file(int(seconds * Audio.sample_rate), filepath)
+
+    synth.system_reset()
+    print(f"{filepath}: {seconds:.2f}s at {audio.get_realtime_factor():.1f}x real time")
+
+
+# drum levels are instrument rows of beat columns. Convert to a list of beats,
+# each beat a list of notes, the same layout DrumsPuzzle plays
+def drum_pattern_to_beats(pattern):
+    beats = []
+    for beat_id in range(len(pattern[0])):
+        beat = []
+        for instrument_id, row in enumerate(pattern):
+            pitch = instruments[instrument_id] if row[beat_id] == "X" else 0
+            beat.append(Note(480, pitch))
+        beats.append(beat)
+    return beats
+
+
+if __name__ == "__main__":
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else "./renders"
+    os.makedirs(out_dir, exist_ok=True)
+
+    synth = get_synth(kSoundfontPath)
+
+    for level, (notes, key) in piano_levels.items():
+        filepath = os.path.join(out_dir, f"piano_{level}.wav")
+        render_notes(synth, list(notes), (0, 0), filepath)
+
+    for level, pattern in drums_levels.items():
+        filepath = os.path.join(out_dir, f"drums_{level}.wav")
+        render_notes(synth, drum_pattern_to_beats(pattern), (128, 0), filepath)
@@ -0,0 +1,90 @@
+from common.audio import Audio
+from common.clock import AudioScheduler, SimpleTempoMap
+from common.mixer import Mixer
+from common.synth import get_synth
+from src.voice_pool import VoicePool
+
+kSoundfontPath = "./data/FluidR3_GM.sf2"
+kNumSynthChannels = 16
+kMaxVoicesPerChannel = 8
+
+
+class AudioEngine(object):
+    """
+    AudioEngine owns the one audio output stream and the one FluidSynth
+    instance for the whole game. Rooms never create their own Audio or Synth;
+    instead each PuzzleSound borrows a synth channel from the pool while its
+    room is active and hands it back when the player leaves.
+
+    The generator chain is:
+        Audio <- Mixer <- AudioScheduler <- Synth
+    so wave-file based generators (eg, the treasure room music) can be added
+    to the same mixer.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self.audio = Audio(2)
+        # shared, lazily loading synth: each preset's samples are loaded the
+        # first time a room selects it
+        self.synth = get_synth(kSoundfontPath)
+        self.voices = VoicePool(self.synth, kMaxVoicesPerChannel)
+
+        self.tempo_map = SimpleTempoMap(120)
+        self.sched = AudioScheduler(self.tempo_map)
+        self.sched.set_generator(self.synth)
+
+        self.mixer = Mixer()
+        self.mixer.set_gain(1.0)
+        self.mixer.add(self.sched)
+        self.audio.set_generator(self.mixer)
+
+        # channel 0 is left for the synth's default program
+        self.free_channels = list(range(1, kNumSynthChannels))
+
+    def acquire_channel(self):
+        if not self.free_channels:
+            raise Exception("AudioEngine: no free synth channels")
+        return self.free_channels.pop(0)
+
+    def release_channel(self, channel):
+        # silence anything still sounding before someone else gets the channel
+        self.post(self.voices.release, channel)
+        if channel not in self.free_channels:
+            self.free_channels.append(channel)
+
+    # run func(*args) wherever the generators live: right away in polled
+    # mode, or on the audio thread in callback mode (see Audio.post)
+    def post(self, func, *args):
+        self.audio.post(func, *args)
+
+    # run func(*args) on the main thread (see Audio.post_to_main). Scheduler
+    # commands use this for callbacks that touch the room's graphics
+    def post_to_main(self, func, *args):
+        self.audio.post_to_main(func, *args)
+
+    def get_num_free_channels(self):
+        return len(self.free_channels)
+
+    def add(self, gen):
+        self.post(self.mixer.add, gen)
+
+    # does nothing if gen is not in the mixer. Checked where the generators
+    # live, since an add() may still be on its way there
+    def remove(self, gen):
+        self.post(self._remove, gen)
+
+    def _remove(self, gen):
+        if gen in self.mixer.generators:
+            self.mixer.remove(gen)
+
+    def on_update(self):
+        self.audio.on_update()
@@ -29,6 +29,11 @@ actual_frets = {0: [3], 1: [7, 2], 2: [2, 6, 4], 3: [1, 7, 5, 3]}
 
 
 class BassPuzzle(Puzzle):
+    texture_sources = Puzzle.texture_sources + (
+        "./data/boulder.jpg",
+        "./data/wall_button.png",
+    )
+
     def __init__(self, level=0, prev_room=None, on_finished_puzzle=None):
         super().__init__()
 
@@ -143,6 +148,12 @@ class BassPuzzle(Puzzle):
         in_range = self.fret_move_range[0] <= pos[0] <= self.fret_move_range[1]
         return same_height and in_range
 
+    def on_enter(self):
+        self.audio.acquire()
+
+    def on_exit(self):
+        self.audio.release()
+
     def on_update(self):
         self.audio.on_update()
         if not self.game_over and self.is_game_over():
@@ -215,7 +226,7 @@ class BassPuzzle(Puzzle):
         pitch = self.string_pitches[string_idx][fret_pos - 1]
         note = Note(480, pitch)
         self.audio.set_notes([note])
-        self.audio.note_seq.start_now()
+        self.audio.start_now()
 
         correct_string = string_idx == len(self.played_strings)
         correct_fret = self.current_frets[string_idx] == self.actual_frets[string_idx]
@@ -229,7 +240,7 @@ class BassPuzzle(Puzzle):
         pitch = self.string_pitches[string_idx][fret_pos - 1]
         note = Note(480, pitch)
         self.audio.set_notes([note])
-        self.audio.note_seq.start_now()
+        self.audio.start_now()
 
     def on_layout(self, win_size):
         self.remove(self.character)
@@ -7,10 +7,18 @@ from src.guitar_puzzle import GuitarPuzzle
 from src.piano_puzzle import PianoPuzzle
 from src.puzzle import Puzzle
 from src.bass_puzzle import BassPuzzle
+from src.textures import preload
 from src.treasure_room import TreasureRoom
 
 
 class CenterRoom(Puzzle):
+    texture_sources = Puzzle.texture_sources + (
+        "./data/bass.png",
+        "./data/drums.png",
+        "./data/piano.png",
+        "./data/guitar.png",
+    )
+
     def __init__(self):
         super().__init__()
 
@@ -60,6 +68,10 @@ class CenterRoom(Puzzle):
         self.create_objects()
         self.place_objects()
 
+        # decode the images of the rooms behind the doors in the background
+        for room in (*self.puzzles.values(), TreasureRoom):
+            preload(room.texture_sources)
+
     def on_finished_puzzle(self):
         if self.last_entered in self.puzzle_finished:
             self.puzzle_finished[self.last_entered] = True
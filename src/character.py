@@ -5,6 +5,7 @@ from kivy.graphics.instructions import InstructionGroup
 from kivy.graphics import Color
 from common.gfxutil import CRectangle
 from src.button import Button
+from src.textures import get_texture
 
 
 class Character(InstructionGroup):
@@ -37,7 +38,7 @@ class Character(InstructionGroup):
             self.size = tile_size
 
         self.sprite = CRectangle(
-            cpos=self.pixel_pos, csize=self.size, source=self.source
+            cpos=self.pixel_pos, csize=self.size, texture=get_texture(self.source)
         )
 
         self.add(Color(1, 1, 1))
@@ -5,6 +5,8 @@ from kivy.graphics.instructions import InstructionGroup
 from common.gfxutil import CRectangle
 from src.button import Button
 from src.grid import DoorTile, Tile
+from src.levels import drums_instruments as instruments
+from src.levels import drums_levels as levels
 from src.puzzle_sound import Note, PuzzleSound
 
 from src.puzzle import Puzzle
@@ -12,15 +14,6 @@ from src.puzzle import Puzzle
 # make audio loop so notes change in real time
 # map a 4 x 4 grid x axis is beat and y axis is instrument (hi-hat, bass drum, etc.)
 # no concept of actual sound
-levels = {
-    0: [" X  ", "XXX ", " X  ", "    "],
-    1: ["XX  ", "X  X", "  XX", "   X"],
-    2: ["  XX", " X  ", "X  X", "X XX"],
-    3: ["X  X", " XX ", "XX  ", "  X "],
-}
-
-# hi-hat, snare, bass drum, tambourine
-instruments = [42, 38, 36, 54]
 all_rests = [[Note(480, 0) for i in instruments] for _ in range(8)]
 
 # character knows which tile its on
@@ -28,6 +21,11 @@ all_rests = [[Note(480, 0) for i in instruments] for _ in range(8)]
 
 
 class DrumsPuzzle(Puzzle):
+    texture_sources = Puzzle.texture_sources + (
+        "./data/button_down.png",
+        "./data/button_up.png",
+    )
+
     def __init__(self, prev_room, level=0, on_finished_puzzle=None):
         super().__init__()
         self.door_sources = {
@@ -153,6 +151,12 @@ class DrumsPuzzle(Puzzle):
         elif button == Button.B:
             self.sound.toggle()
 
+    def on_enter(self):
+        self.sound.acquire()
+
+    def on_exit(self):
+        self.sound.release()
+
     def on_update(self):
         self.sound.on_update()
         if self.sequencer_tiles:
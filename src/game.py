@@ -2,6 +2,7 @@
 from kivy.core.window import Window
 from kivy.graphics.instructions import InstructionGroup
 
+from src.grid import instruction_stats
 from src.intro_room import IntroRoom
 
 
@@ -21,12 +22,15 @@ class Game(InstructionGroup):
         transition = self.puzzle.on_player_input(button)
         if transition:
             self.remove(self.puzzle)
+            self.puzzle.on_exit()
             self.puzzle = transition
+            self.puzzle.on_enter()
             self.puzzle.on_layout(self.win_size)
             self.add(self.puzzle)
 
     def on_update(self):
         self.puzzle.on_update()
+        instruction_stats.end_frame()
 
     def on_layout(self, win_size):
         self.win_size = win_size
@@ -2,11 +2,49 @@ from kivy.core.window import Window
 from kivy.graphics import Color, Line, PopMatrix, PushMatrix, Rectangle, Translate
 from kivy.graphics.instructions import InstructionGroup
 
+from src.textures import get_texture
+
+
+class InstructionStats(object):
+    """
+    Counts the canvas instructions that tiles create, remove and mutate, for
+    profiling. Game calls end_frame() once per frame; get_last_frame() returns
+    the counts of the last complete frame.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.created = 0
+        self.removed = 0
+        self.mutated = 0
+        self.last_frame = (0, 0, 0)
+
+    def end_frame(self):
+        self.last_frame = (self.created, self.removed, self.mutated)
+        self.created = 0
+        self.removed = 0
+        self.mutated = 0
+
+    # (created, removed, mutated)
+    def get_last_frame(self):
+        return self.last_frame
+
+    # obj was taken off the canvas. Counts its instructions if it keeps track
+    # of how many it created (tiles do)
+    def count_removed(self, obj):
+        self.removed += getattr(obj, "num_instructions", 0)
+
+
+instruction_stats = InstructionStats()
+
 
 class Tile(InstructionGroup):
     border_color = Color(rgba=(0.6, 0.3, 0, 0))
     base_color = Color(rgba=(1, 0.9, 0.8, 1))
 
+    # instructions each tile creates. The border color is shared
+    num_instructions = 3
+
     def __init__(self, size, pos):
         super().__init__()
         self.size = size
@@ -14,7 +52,10 @@ class Tile(InstructionGroup):
 
         self.passable = True
         self.moveable = False
-        self.inside_color = Tile.base_color
+
+        # a tile's instructions last as long as the tile: set_color and
+        # set_pos change them in place
+        self.inside_color = Color(rgba=Tile.base_color.rgba)
         self.inside_rect = Rectangle(size=self.size, pos=self.pos)
         self.add(self.inside_color)
         self.add(self.inside_rect)
@@ -23,18 +64,23 @@ class Tile(InstructionGroup):
         self.border_line = Line(rectangle=(pos[0], pos[1], size[0], size[1]))
         self.add(self.border_color)
         self.add(self.border_line)
+        instruction_stats.created += self.num_instructions
 
     def set_color(self, color, source=None):
-        self.remove(self.inside_rect)
-        self.remove(self.border_line)
+        if self.inside_color.rgba != color.rgba:
+            self.inside_color.rgba = color.rgba
+            instruction_stats.mutated += 1
 
-        self.inside_color = Color(rgba=color.rgba)
-        self.inside_rect = Rectangle(size=self.size, pos=self.pos, source=source)
-        self.add(self.inside_color)
-        self.add(self.inside_rect)
+        texture = get_texture(source)
+        if self.inside_rect.texture is not texture:
+            self.inside_rect.texture = texture
+            instruction_stats.mutated += 1
 
-        self.add(self.border_color)
-        self.add(self.border_line)
+    def set_pos(self, pos):
+        self.pos = pos
+        self.inside_rect.pos = pos
+        self.border_line.rectangle = (pos[0], pos[1], self.size[0], self.size[1])
+        instruction_stats.mutated += 2
 
 
 class Switch(Tile):
@@ -172,6 +218,10 @@ class Grid(InstructionGroup):
         x, y = pos
         return (x * self.tile_side_len, y * self.tile_side_len)
 
+    def remove(self, obj):
+        super().remove(obj)
+        instruction_stats.count_removed(obj)
+
     def on_layout(self, win_size):
         for row in self.tiles:
             for tile in row:
@@ -3,7 +3,7 @@ from kivy.graphics.instructions import InstructionGroup
 
 from common.gfxutil import CRectangle
 from src.button import Button
-from src.grid import DoorTile, Tile
+from src.grid import DoorTile, Tile, instruction_stats
 from src.puzzle_sound import Note, PuzzleSound
 
 from src.puzzle import Puzzle
@@ -19,6 +19,8 @@ sources = ["./data/sarco.jpg", "./data/mummy.jpg", "./data/anubis.jpg", "./data/
 
 
 class GuitarPuzzle(Puzzle):
+    texture_sources = Puzzle.texture_sources + tuple(sources)
+
     def __init__(self, prev_room=None, level=0, on_finished_puzzle=None):
         super().__init__()
         self.door_sources = {
@@ -87,7 +89,7 @@ class GuitarPuzzle(Puzzle):
             self.audio.set_cb_ons(cb_ons)
             self.audio.set_cb_offs(cb_offs)
             self.audio.set_on_finished(self.change_to_user_turn)
-            self.audio.note_seq.start_now()
+            self.audio.start_now()
 
         else:
             if idx == self.correct_sequence[len(self.user_sequence)]:
@@ -116,7 +118,7 @@ class GuitarPuzzle(Puzzle):
             self.audio.set_cb_ons([self.simons[idx].activate])
             self.audio.set_cb_offs([self.simons[idx].deactivate])
             self.audio.set_on_finished(self.simons[idx].on_finished_playing)
-            self.audio.note_seq.start_now()
+            self.audio.start_now()
 
     def create_objects(self):
         self.objects = {}
@@ -186,6 +188,12 @@ class GuitarPuzzle(Puzzle):
         elif button == Button.A:
             self.character.interact()
 
+    def on_enter(self):
+        self.audio.acquire()
+
+    def on_exit(self):
+        self.audio.release()
+
     def on_update(self):
         self.audio.on_update()
 
@@ -226,6 +234,9 @@ class GuitarPuzzle(Puzzle):
 
 
 class SimonSays(InstructionGroup):
+    # instructions created, for the instruction stats
+    num_instructions = 2
+
     def __init__(self, size, pos, color, idx, on_interact, puzzle):
         super().__init__()
         self.size = size
@@ -243,16 +254,14 @@ class SimonSays(InstructionGroup):
         self.rect = CRectangle(csize=self.size, cpos=self.pos)
         self.add(self.current_color)
         self.add(self.rect)
+        instruction_stats.created += self.num_instructions
 
         self.deactivate()
 
     def set_color(self, color):
-        self.remove(self.rect)
-
-        self.current_color = Color(rgba=(*color.rgba,))
-        self.rect = CRectangle(csize=self.size, cpos=self.pos)
-        self.add(self.current_color)
-        self.add(self.rect)
+        if self.current_color.rgba != color.rgba:
+            self.current_color.rgba = color.rgba
+            instruction_stats.mutated += 1
 
     def interact(self):
         self.on_interact(self.idx)
@@ -6,15 +6,21 @@ from src.button import Button
 from src.center_room import CenterRoom
 from src.grid import PyramidTile, Tile
 from src.puzzle import Puzzle
+from src.textures import preload
 
 
 class IntroRoom(Puzzle):
+    texture_sources = Puzzle.texture_sources + ("./data/sand3.png", "./data/pyramid.png")
+
     def __init__(self):
         super().__init__()
         self.win_size = (Window.width, Window.height)
         self.place_objects()
         self.create_instructions()
 
+        # decode the next room's images while the player reads the intro
+        preload(CenterRoom.texture_sources)
+
     def create_instructions(self):
         margin = self.grid.tile_side_len // 2
         self.instructions_window_color = Color(rgba=(1, 1, 1, 1))
@@ -0,0 +1,77 @@
+from src.puzzle_sound import Note
+
+# The notes of every puzzle level. Kept apart from the puzzles themselves so
+# that tools like render_levels.py can use them without importing Kivy.
+
+# piano: level -> (notes, key)
+piano_levels = {
+    0: [
+        (
+            Note(480, 62),
+            Note(480, 64),
+            Note(480, 65),
+            Note(480, 67),
+            Note(480, 69),
+            Note(480, 71),
+            Note(480, 72),
+            Note(480, 74),
+        ),
+        "C",
+    ],
+    1: [
+        (
+            Note(240, 74),
+            Note(240, 73),
+            Note(240, 70),
+            Note(240, 73),
+            Note(240, 74),
+            Note(240, 70),
+            Note(240, 68),
+            Note(240, 66),
+            Note(240, 62),
+            Note(240, 64),
+            Note(240, 63),
+            Note(240, 64),
+            Note(240, 66),
+            Note(240, 62),
+        ),
+        "D",
+    ],
+    2: [
+        (
+            Note(480, 69),
+            Note(480, 70),
+            Note(480, 72),
+            Note(480, 69),
+            Note(480, 67),
+            Note(480, 69),
+            Note(480, 71),
+            Note(480, 72),
+        ),
+        "F",
+    ],
+    3: [
+        (
+            Note(480, 70),
+            Note(480, 69),
+            Note(480, 67),
+            Note(480, 59),
+            Note(480, 73),
+            Note(480, 71),
+            Note(480, 70),
+            Note(480, 71),
+        ),
+        "Bb",
+    ],
+}
+
+# drums: one row per instrument, one column per beat, X where it plays
+drums_levels = {
+    0: [" X  ", "XXX ", " X  ", "    "],
+    1: ["XX  ", "X  X", "  XX", "   X"],
+    2: ["  XX", " X  ", "X  X", "X XX"],
+    3: ["X  X", " XX ", "XX  ", "  X "],
+}
+
+# hi-hat, snare, bass drum, tambourine
+drums_instruments = [42, 38, 36, 54]
@@ -15,70 +15,11 @@ from kivy.graphics.instructions import InstructionGroup
 from src.button import Button
 from common.gfxutil import AnimGroup, CLabelRect, KFAnim, CRectangle
 from src.grid import DoorTile, Switch, Tile
-from src.puzzle_sound import Note, PuzzleSound
+from src.levels import piano_levels as levels
+from src.puzzle_sound import NoteArray, PuzzleSound
 
 from src.puzzle import Puzzle
-
-levels = {
-    0: [
-        (
-            Note(480, 62),
-            Note(480, 64),
-            Note(480, 65),
-            Note(480, 67),
-            Note(480, 69),
-            Note(480, 71),
-            Note(480, 72),
-            Note(480, 74),
-        ),
-        "C",
-    ],
-    1: [
-        (
-            Note(240, 74),
-            Note(240, 73),
-            Note(240, 70),
-            Note(240, 73),
-            Note(240, 74),
-            Note(240, 70),
-            Note(240, 68),
-            Note(240, 66),
-            Note(240, 62),
-            Note(240, 64),
-            Note(240, 63),
-            Note(240, 64),
-            Note(240, 66),
-            Note(240, 62),
-        ),
-        "D",
-    ],
-    2: [
-        (
-            Note(480, 69),
-            Note(480, 70),
-            Note(480, 72),
-            Note(480, 69),
-            Note(480, 67),
-            Note(480, 69),
-            Note(480, 71),
-            Note(480, 72),
-        ),
-        "F",
-    ],
-    3: [
-        (
-            Note(480, 70),
-            Note(480, 69),
-            Note(480, 67),
-            Note(480, 59),
-            Note(480, 73),
-            Note(480, 71),
-            Note(480, 70),
-            Note(480, 71),
-        ),
-        "Bb",
-    ],
-}
+from src.textures import get_texture
 
 notes_w_staff_lines = ["E4", "G4", "B4", "D5", "F5"]
 names = "CDEFGAB"
@@ -102,6 +43,14 @@ keys = {
 
 
 class PianoPuzzle(Puzzle):
+    texture_sources = Puzzle.texture_sources + (
+        "./data/pitch_slider.png",
+        "./data/rhythm_slider.png",
+        "./data/key_slider.png",
+        "./data/trackv2.png",
+        "./data/treble_clef_white.png",
+    )
+
     def __init__(self, prev_room, level=0, on_finished_puzzle=None):
         super().__init__()
         self.door_sources = {
@@ -118,9 +67,9 @@ class PianoPuzzle(Puzzle):
         self.notes, self.actual_key = levels[level]
         duration = choice(durations)
         pitch_shift = choice(range(-3, 4))
-        self.user_notes = [
-            Note(duration, n.get_pitch() + pitch_shift) for n in self.notes
-        ]
+        self.user_notes = NoteArray(self.notes)
+        self.user_notes.transpose(pitch_shift)
+        self.user_notes.set_dur(duration)
         render_user_notes = self.level < 2
 
         self.actual_sound = PuzzleSound(self.notes)
@@ -164,39 +113,21 @@ class PianoPuzzle(Puzzle):
 
     def on_pitch_change(self, pitch_index):
         offset = 1 if self.character.direction == Button.RIGHT.value else -1
-        for note in self.user_notes:
-            pitch = note.get_pitch()
-            note.set_note(pitch + offset)
-        self.user_sound.set_notes(self.user_notes)
+        self.user_notes.transpose(offset)
+        self.user_sound.update_pitches()
 
     def on_duration_change(self, dur_index):
-        for note in self.user_notes:
-            note.set_dur(durations[dur_index])
+        self.user_notes.set_dur(durations[dur_index])
         self.user_sound.set_notes(self.user_notes)
 
     def on_key_change(self, key_index):
         self.user_key = key_names[key_index]
         self.update_key()
-        self.user_sound.set_notes(self.user_notes)
+        self.user_sound.update_pitches()
 
     def update_key(self):
         key_sig = keys[self.user_key]
-        for note in self.user_notes:
-            base_letter = note.get_letter()[0]
-            letter_before = names[names.index(base_letter) - 1]
-            if base_letter not in key_sig["#"]:
-                note.remove_sharp()
-            if base_letter not in key_sig["b"]:
-                note.remove_flat()
-
-            if base_letter in key_sig["#"] and not (
-                note.get_letter()[:-1] == base_letter + "#"
-            ):
-                note.add_sharp()
-            if base_letter in key_sig["b"] and not (
-                note.get_letter()[:-1] == letter_before + "#"
-            ):
-                note.add_flat()
+        self.user_notes.set_key(key_sig["#"], key_sig["b"])
 
     """ Mandatory Puzzle methods """
 
@@ -283,20 +214,8 @@ class PianoPuzzle(Puzzle):
         if self.is_valid_pos(obj_loc) and self.valid_block_move(
             obj_loc, self.objects[new_location].move_range
         ):
-            self.remove(self.objects[new_location])
-            obj = MovingBlock(
-                self.objects[new_location].size,
-                self.grid.grid_to_pixel(obj_loc),
-                self.objects[new_location].move_range,
-                self.objects[new_location].icon_source,
-                self.objects[new_location].callback,
-            )
-            del self.objects[new_location]
-
-            self.add(PushMatrix())
-            self.add(Translate(*self.grid.pos))
-            self.add(obj)
-            self.add(PopMatrix())
+            obj = self.objects.pop(new_location)
+            obj.set_pos(self.grid.grid_to_pixel(obj_loc))
 
             self.objects[obj_loc] = obj
             self.objects[obj_loc].on_block_placement(obj_loc)
@@ -346,10 +265,18 @@ class PianoPuzzle(Puzzle):
         elif button == Button.PLUS:
             self.play(actual=False)
 
+    def on_enter(self):
+        self.actual_sound.acquire()
+        self.user_sound.acquire()
+
+    def on_exit(self):
+        self.actual_sound.release()
+        self.user_sound.release()
+
     def on_update(self):
         self.animations.on_update()
+        # both sounds share the same engine, so one update drives them both
         self.actual_sound.on_update()
-        self.user_sound.on_update()
         self.key_label.set_text(f"Key: {self.user_key}")
         if not self.game_over and self.is_game_over():
             for pos, obj in self.objects.items():
@@ -466,7 +393,7 @@ class MusicBar(InstructionGroup):
         for line in self.staff_lines:
             self.add(line)
         self.clef = Rectangle(
-            source="./data/treble_clef_white.png",
+            texture=get_texture("./data/treble_clef_white.png"),
             pos=(self.win_size[0] / 50, self.height + self.middle_c_h),
             size=(self.win_size[0] / 22, self.height / 4.5),
         )
@@ -1,5 +1,5 @@
 from kivy.graphics.instructions import InstructionGroup
-from src.grid import Grid
+from src.grid import Grid, instruction_stats
 from kivy.core.window import Window
 from kivy.graphics import Color
 from common.gfxutil import CLabelRect, CRectangle
@@ -7,6 +7,21 @@ from src.character import Character
 
 
 class Puzzle(InstructionGroup):
+    # images drawn by every room: floor, walls, doors and the character.
+    # Subclasses add their own, so they can be preloaded (see src.textures)
+    texture_sources = (
+        "./data/sand1.png",
+        "./data/brickfloor.png",
+        "./data/Door_up.png",
+        "./data/door_down.png",
+        "./data/door_left.png",
+        "./data/Door_right.png",
+        "./data/character_up.png",
+        "./data/character_down.png",
+        "./data/character_left.png",
+        "./data/character_right.png",
+    )
+
     def __init__(self):
         super().__init__()
 
@@ -23,6 +38,11 @@ class Puzzle(InstructionGroup):
         self.character = Character(self)
         self.add(self.character)
 
+    # tiles removed from the room count towards the instruction stats
+    def remove(self, obj):
+        super().remove(obj)
+        instruction_stats.count_removed(obj)
+
     def is_valid_pos(self, pos):
         if pos[0] < 0 or pos[0] >= self.grid.num_tiles:
             return False
@@ -69,3 +89,13 @@ class Puzzle(InstructionGroup):
 
     def on_layout(self, win_size):
         raise NotImplementedError
+
+    """ Optional Puzzle methods """
+
+    # called when the player walks into this room
+    def on_enter(self):
+        pass
+
+    # called when the player walks out of this room
+    def on_exit(self):
+        pass
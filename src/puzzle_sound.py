@@ -1,11 +1,11 @@
-from common.audio import Audio
-from common.clock import (
-    AudioScheduler,
-    SimpleTempoMap,
-    kTicksPerQuarter,
-    quantize_tick_up,
-)
-from common.synth import Synth
+import time
+from functools import partial
+
+import numpy as np
+
+from common.clock import kTicksPerQuarter, quantize_tick_up
+from src.audio_engine import AudioEngine
+from src.voice_pool import VoicePool
 
 
 class PuzzleSound(object):
@@ -13,13 +13,17 @@ class PuzzleSound(object):
         self, notes, bank=0, preset=0, loop=False, simon_says=False, bass_puzzle=False
     ):
         super().__init__()
-        self.audio = Audio(2)
-        self.synth = Synth("./data/FluidR3_GM.sf2")
-
-        self.tempo_map = SimpleTempoMap(120)
-        self.sched = AudioScheduler(self.tempo_map)
-        self.sched.set_generator(self.synth)
-        self.audio.set_generator(self.sched)
+        self.engine = AudioEngine.get()
+        self.synth = self.engine.synth
+        self.tempo_map = self.engine.tempo_map
+        self.sched = self.engine.sched
+        self.channel = None
+
+        # time from acquiring a channel (entering the room) until a note
+        # could sound: the preset is selected and a block has rendered with it
+        self.acquire_time = None
+        self.load_timer = None
+        self.time_to_first_note = None
 
         self.notes = notes
         self.bank = bank
@@ -31,54 +35,227 @@ class PuzzleSound(object):
         self.note_seq = NoteSequencer(
             sched=self.sched,
             synth=self.synth,
-            channel=1,
+            channel=self.channel,
             program=(self.bank, self.preset),
             notes=self.notes,
             loop=self.loop,
+            voices=self.engine.voices,
         )
+        self.acquire()
+
+    # borrow a synth channel from the shared engine. Safe to call repeatedly.
+    # Selecting the program here loads the preset's samples (the synth loads
+    # them lazily) before the first note needs them. Like everything else that
+    # touches note_seq, the channel change is posted, so it lands after a stop
+    # posted by an earlier release().
+    def acquire(self):
+        if self.channel is None:
+            self.channel = self.engine.acquire_channel()
+            self.engine.post(self.note_seq.set_channel, self.channel)
+            self.engine.post(self.synth.program, self.channel, self.bank, self.preset)
+
+            self.acquire_time = time.perf_counter()
+            self.load_timer = BlockTimer()
+            self.engine.add(self.load_timer)
+            self.time_to_first_note = None
+
+    # stop playing and give the synth channel back to the shared engine
+    def release(self):
+        if self.channel is not None:
+            self.engine.post(self.note_seq.stop)
+            self.engine.release_channel(self.channel)
+            self.channel = None
 
     def set_notes(self, notes):
+        self.acquire()
         self.notes = notes
-        if self.simon_says or self.bass_puzzle:
-            self.note_seq = NoteSequencer(
-                sched=self.sched,
-                synth=self.synth,
-                channel=1,
-                program=(self.bank, self.preset),
-                notes=self.notes,
-                loop=self.loop,
-            )
-
-        self.note_seq.stop()
-        self.note_seq.set_notes(self.notes)
+
+        self.engine.post(self.note_seq.stop)
+        self.engine.post(self.note_seq.set_notes, self.notes)
 
         if self.bank == 0:
-            self.letters = [n.get_letter() for n in self.notes]
+            self.letters = self._get_letters()
+
+    # the notes were transposed in place: recompile only their pitches
+    def update_pitches(self):
+        self.engine.post(self.note_seq.update_pitches)
 
+        if self.bank == 0:
+            self.letters = self._get_letters()
+
+    def _get_letters(self):
+        if isinstance(self.notes, NoteArray):
+            return self.notes.get_letters()
+        return [n.get_letter() for n in self.notes]
+
+    # the callbacks are called by scheduler commands, which run on the audio
+    # thread in callback mode. They touch the room's graphics, so they are
+    # handed back to the main thread.
     def set_cb_ons(self, cb_ons):
-        self.note_seq.set_cb_ons(cb_ons)
+        self.engine.post(self.note_seq.set_cb_ons, self._on_main_thread(cb_ons))
 
     def set_cb_offs(self, cb_offs):
-        self.note_seq.set_cb_offs(cb_offs)
+        self.engine.post(self.note_seq.set_cb_offs, self._on_main_thread(cb_offs))
 
     def set_on_finished(self, on_finished):
-        self.note_seq.set_on_finished(on_finished)
+        if on_finished is not None:
+            on_finished = partial(self.engine.post_to_main, on_finished)
+        self.engine.post(self.note_seq.set_on_finished, on_finished)
+
+    def _on_main_thread(self, callbacks):
+        return [partial(self.engine.post_to_main, cb) for cb in callbacks]
 
     def toggle(self):
-        self.note_seq.toggle()
+        self.acquire()
+        self.engine.post(self.note_seq.toggle)
+
+    def start_now(self):
+        self.acquire()
+        self.engine.post(self.note_seq.start_now)
+
+    # seconds from acquire() until the preset was selected and one block
+    # rendered with it, ie until the first note could sound. None if that
+    # block hasn't rendered yet
+    def get_time_to_first_note(self):
+        if self.time_to_first_note is None and self.load_timer.time is not None:
+            self.time_to_first_note = self.load_timer.time - self.acquire_time
+        return self.time_to_first_note
 
     def on_update(self):
-        self.audio.on_update()
+        self.engine.on_update()
+
+
+# A silent generator that notes the time it is first asked for a block, and
+# then leaves the mixer. Added to the engine after the scheduler, so that is
+# when the synth has rendered everything posted before it.
+class BlockTimer(object):
+    silence = np.zeros(0, dtype=np.float32)
+
+    def __init__(self):
+        super().__init__()
+        self.time = None
+
+    def generate(self, num_frames, num_channels):
+        self.time = time.perf_counter()
+        return self.silence, False
+
+
+# one row per note on and per note off, sorted by tick (note offs first on a
+# tie). Ticks are relative to the start of the sequence. step is the index of
+# the step in the sequence, note the index of the note in the flattened list
+# of notes
+kEventDtype = np.dtype(
+    [
+        ("tick", np.int64),
+        ("step", np.int32),
+        ("note", np.int32),
+        ("channel", np.int8),
+        ("pitch", np.int16),
+        ("velocity", np.int16),
+        ("on", np.bool_),
+    ]
+)
+
+
+class NoteTimeline(object):
+    """A sequence of notes compiled into a structured array of note on / off
+    events. The sequence is a list of steps, each a Note or a list of Notes
+    played together; the next step starts after the duration of the last note
+    in the step.
+
+    In "detached" style (the default), each note ends at 90% of its duration.
+    In "simon" style, each note plays for its full duration, followed by gap
+    ticks of silence before the next step."""
+
+    def __init__(self, notes, channel, vel, style="detached", gap=240):
+        super().__init__()
+        self.style = style
+        self.gap = gap
+        self.compile(notes, channel, vel)
+
+    def compile(self, notes, channel, vel):
+        if isinstance(notes, NoteArray):
+            # one note per step, read straight from the arrays
+            self.flat_notes = notes
+            durs = notes.durs
+            step_sizes = np.ones(len(notes), dtype=np.int64)
+        else:
+            steps = [step if type(step) is list else [step] for step in notes]
+            self.flat_notes = [note for step in steps for note in step]
+            durs = np.array([note.get_dur() for note in self.flat_notes], dtype=np.int64)
+            step_sizes = [len(step) for step in steps]
+        num_notes = len(self.flat_notes)
+        num_steps = len(step_sizes)
+
+        pitches = self._get_pitches()
+        note_steps = np.repeat(np.arange(num_steps), step_sizes)
+
+        # the last note of each step sets the step length
+        last_notes = np.cumsum(step_sizes) - 1
+        step_lens = durs[last_notes] if num_steps else np.zeros(0, np.int64)
+        if self.style == "simon":
+            note_lens = durs
+            step_lens = step_lens + self.gap
+        else:
+            note_lens = (durs * 0.9).astype(np.int64)
+        step_starts = np.concatenate(([0], np.cumsum(step_lens)))
+        self.length = int(step_starts[-1])
+
+        events = np.zeros(2 * num_notes, dtype=kEventDtype)
+        ons, offs = events[:num_notes], events[num_notes:]
+        ons["tick"] = step_starts[:-1][note_steps]
+        offs["tick"] = ons["tick"] + note_lens
+        ons["on"] = True
+        for half in (ons, offs):
+            half["step"] = note_steps
+            half["note"] = np.arange(num_notes)
+            half["pitch"] = pitches
+            half["velocity"] = vel
+
+        # stable sort on (tick, on): note offs before note ons on the same
+        # tick, otherwise in sequence order
+        order = np.lexsort((events["on"], events["tick"]))
+        self.events = events[order]
+        self.set_channel(channel)
+
+    # re-read the pitches of the notes (eg, after they were transposed)
+    # without recompiling
+    def update_pitches(self):
+        self.events["pitch"] = self._get_pitches()[self.events["note"]]
+        self.rows = self.events.tolist()
+
+    def _get_pitches(self):
+        if isinstance(self.flat_notes, NoteArray):
+            return self.flat_notes.pitches.astype(np.int16)
+        return np.array([note.get_pitch() for note in self.flat_notes], dtype=np.int16)
+
+    def set_channel(self, channel):
+        self.events["channel"] = -1 if channel is None else channel
+        self.rows = self.events.tolist()
+
+    # index of the first event at or after tick
+    def find(self, tick):
+        return int(np.searchsorted(self.events["tick"], tick, side="left"))
+
+    def __len__(self):
+        return len(self.events)
 
 
 class NoteSequencer(object):
     """Plays a single Sequence of notes. The sequence is a python list containing
-    notes. Each note is (dur, pitch)."""
+    notes. Each note is (dur, pitch). Notes are played through a VoicePool, which
+    limits how many can sound at once.
 
-    def __init__(self, sched, synth, channel, program, notes, vel=60, loop=False):
+    The sequence is compiled into a NoteTimeline once; playing just walks a
+    cursor through its events, one scheduler command per event tick."""
+
+    def __init__(
+        self, sched, synth, channel, program, notes, vel=60, loop=False, voices=None
+    ):
         super().__init__()
         self.sched = sched
         self.synth = synth
+        self.voices = voices if voices is not None else VoicePool(synth)
         self.channel = channel
         self.program = program
         self.vel = vel
@@ -91,11 +268,38 @@ class NoteSequencer(object):
 
         self.playing = False
 
+        # timelines compiled so far, by style
+        self.timelines = {}
+        self.timeline = None
+
+        # playback state: start tick of the current pass through the
+        # timeline, next event to play, current step, and the pitch each
+        # sounding note was started with
         self.cmd = None
-        self.idx = 0
+        self.base_tick = 0
+        self.cursor = 0
+        self.step = -1
+        self.sounding = {}
 
     def set_notes(self, notes):
         self.notes = notes
+        self.timelines = {}
+        if self.playing:
+            # pick up the new notes from the same position
+            self._release_sounding()
+            rel_tick = self.sched.get_tick() - self.base_tick
+            self.timeline = self._get_timeline(self.timeline.style)
+            self.cursor = self.timeline.find(rel_tick)
+
+    # the pitches of the notes changed, but nothing else did
+    def update_pitches(self):
+        for timeline in self.timelines.values():
+            timeline.update_pitches()
+
+    def set_channel(self, channel):
+        self.channel = channel
+        for timeline in self.timelines.values():
+            timeline.set_channel(channel)
 
     def set_cb_ons(self, cb_ons):
         self.cb_ons = cb_ons
@@ -107,21 +311,14 @@ class NoteSequencer(object):
         self.on_finished = on_finished
 
     def start(self):
-        if self.playing:
-            return
-
-        self.playing = True
-        self.synth.program(self.channel, self.program[0], self.program[1])
-
-        # start from the beginning
-        self.idx = 0
-
         # post the first note on the next quarter-note:
         now = self.sched.get_tick()
-        next_beat = quantize_tick_up(now, kTicksPerQuarter)
-        self.cmd = self.sched.post_at_tick(self._note_on, next_beat)
+        self._start(quantize_tick_up(now, kTicksPerQuarter), "detached")
 
     def start_now(self):
+        self._start(self.sched.get_tick(), "simon")
+
+    def _start(self, tick, style):
         if self.playing:
             return
 
@@ -129,11 +326,11 @@ class NoteSequencer(object):
         self.synth.program(self.channel, self.program[0], self.program[1])
 
         # start from the beginning
-        self.idx = 0
-
-        # post the first note on the next quarter-note:
-        now = self.sched.get_tick()
-        self.cmd = self.sched.post_at_tick(self.simon_says_on, now)
+        self.timeline = self._get_timeline(style)
+        self.base_tick = tick
+        self.cursor = 0
+        self.step = -1
+        self._post_next()
 
     def stop(self):
         if not self.playing:
@@ -143,124 +340,119 @@ class NoteSequencer(object):
         self.sched.remove(self.cmd)
         self.cmd = None
 
+        # silence everything at once
+        self.sounding = {}
+        self.voices.release(self.channel)
+
     def toggle(self):
         if self.playing:
             self.stop()
         else:
             self.start()
 
-    def _note_on(self, tick, ignore):
-        # if looping, go back to beginning
-        if self.loop and self.idx >= len(self.notes):
-            self.idx = 0
+    def _get_timeline(self, style):
+        if style not in self.timelines:
+            self.timelines[style] = NoteTimeline(self.notes, self.channel, self.vel, style)
+        return self.timelines[style]
 
-        # play new note if available
-        if self.idx < len(self.notes):
-            if type(self.notes[self.idx]) is list:
-                notes_list = self.notes[self.idx]
-            else:
-                notes_list = [self.notes[self.idx]]
-
-            for note in notes_list:
-                dur = note.get_dur()
-                pitch = note.get_pitch()
-                self.synth.noteon(self.channel, pitch, self.vel)  # play note
-                self.sched.post_at_tick(
-                    self._note_off, tick + dur * 0.9, pitch
-                )  # note off a bit later - slightly detached.
-
-            # Call cb_on if it's there
-            if self.idx < len(self.cb_ons):
-                print("Played now bar")
-                cb_on = self.cb_ons[self.idx]
-                cb_on()
-
-            # schedule the next note:
-            self.idx += 1
-            self.cmd = self.sched.post_at_tick(self._note_on, tick + dur)
-        else:
-            self.playing = False
-
-    def _note_off(self, tick, pitch):
-        # terminate current note:
-        self.synth.noteoff(self.channel, pitch)
-
-    def simon_says_on(self, tick, ignore):
-        if self.idx < len(self.notes):
-            note = self.notes[self.idx]
-            dur = note.get_dur()
-            pitch = note.get_pitch()
-            if self.cb_ons and self.idx < len(self.cb_ons):
-                cb_on = self.cb_ons[self.idx]
-                cb_on()
-
-            # Play note and activate simon says tile
-            self.synth.noteon(self.channel, pitch, self.vel)
-
-            # Schedule note and tile to turn off
-            now = self.sched.get_tick()
-            self.cmd = self.sched.post_at_tick(self.simon_says_off, now + dur, pitch)
-            self.playing = True
+    # post a command for the next event, the end of the pass, or the next pass
+    def _post_next(self):
+        if self.cursor < len(self.timeline):
+            tick = self.base_tick + self.timeline.rows[self.cursor][0]
         else:
-            self.playing = False
-            if self.on_finished:
-                self.on_finished()
+            tick = self.base_tick + self.timeline.length
+        self.cmd = self.sched.post_at_tick(self._play_events, tick)
+
+    # play every event due at tick
+    def _play_events(self, tick, ignore):
+        rows = self.timeline.rows
+        rel_tick = tick - self.base_tick
+
+        if self.cursor == len(rows):
+            # end of the pass
+            if self.loop and len(rows):
+                self.base_tick += self.timeline.length
+                self.cursor = 0
+                self.step = -1
+                self._post_next()
+            else:
+                self.playing = False
+                self.cmd = None
+                if self.on_finished:
+                    self.on_finished()
+            return
 
-    def simon_says_off(self, tick, pitch):
-        self.synth.noteoff(self.channel, pitch)
-        if self.cb_offs and self.idx < len(self.cb_offs):
-            cb_off = self.cb_offs[self.idx]
-            cb_off()
-        self.idx += 1
+        offs = []
+        off_steps = []
+        while self.cursor < len(rows) and rows[self.cursor][0] <= rel_tick:
+            _, step, note, channel, pitch, vel, on = rows[self.cursor]
+            self.cursor += 1
+
+            if on:
+                if step != self.step:
+                    self.step = step
+                    if step < len(self.cb_ons):
+                        self.cb_ons[step]()
+                self.voices.note_on(channel, pitch, vel)
+                self.sounding[note] = pitch
+            else:
+                if note in self.sounding:
+                    offs.append(self.sounding.pop(note))
+                if step < len(self.cb_offs) and step not in off_steps:
+                    off_steps.append(step)
 
-        now = self.sched.get_tick()
-        self.cmd = self.sched.post_at_tick(self.simon_says_on, now + 240)
+        # all the notes ending now, in one batch
+        if offs:
+            self.voices.note_off(self.channel, offs)
+        for step in off_steps:
+            self.cb_offs[step]()
+
+        self._post_next()
+
+    def _release_sounding(self):
+        if self.sounding:
+            self.voices.note_off(self.channel, list(self.sounding.values()))
+            self.sounding = {}
+
+
+# pitch class names, indexed by midi pitch % 12. Notes are always spelled
+# with sharps
+kPitchClasses = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+kLetters = "CDEFGAB"
+
+# per pitch class: index of its letter in kLetters, and whether it is sharp
+kLetterIndex = np.array([0, 0, 1, 1, 2, 3, 3, 4, 4, 5, 5, 6])
+kIsSharp = np.array([False, True, False, True, False, False, True, False, True, False, True, False])
+
+
+def pitch_to_letter(pitch):
+    return kPitchClasses[pitch % 12] + str(pitch // 12 - 1)
 
 
 class Note(object):
+    """A single note: a duration in ticks and a midi pitch. sharp and flat
+    record whether the note was raised or lowered by a key signature. The
+    letter (eg, "C#4") is computed from the pitch when asked for."""
+
+    __slots__ = ("notedur", "midipitch", "sharp", "flat")
+
     def __init__(self, notedur, midipitch):
         super().__init__()
-
-        self.allnotes = [
-            "C",
-            "C#",
-            "D",
-            "D#",
-            "E",
-            "F",
-            "F#",
-            "G",
-            "G#",
-            "A",
-            "A#",
-            "B",
-        ]
-        octave = int(midipitch / 12) - 1
-        noteidx = midipitch % 12
-
-        self.noteletter = self.allnotes[noteidx] + str(octave)
-        self.midipitch = midipitch
         self.notedur = notedur
+        self.midipitch = midipitch
 
         self.sharp = False
         self.flat = False
 
     def set_note(self, pitch):
-        octave = int(pitch / 12) - 1
-        noteidx = pitch % 12
-        self.noteletter = self.allnotes[noteidx] + str(octave)
-
         self.midipitch = pitch
 
     def get_letter(self):
-        return self.noteletter
+        return pitch_to_letter(self.midipitch)
 
     def get_pitch(self):
         return self.midipitch
 
-    def get_pitch_to_play(self):
-        return self.adj_pitch
-
     def set_dur(self, dur):
         self.notedur = dur
 
@@ -287,3 +479,168 @@ class Note(object):
             self.set_note(self.get_pitch() + 1)
             self.flat = False
 
+
+class NoteRef(Note):
+    """A Note stored in row idx of a NoteArray. Reads and writes go straight
+    to the array."""
+
+    __slots__ = ("array", "idx")
+
+    def __init__(self, array, idx):
+        self.array = array
+        self.idx = idx
+
+    @property
+    def notedur(self):
+        return int(self.array.durs[self.idx])
+
+    @notedur.setter
+    def notedur(self, dur):
+        self.array.durs[self.idx] = dur
+
+    @property
+    def midipitch(self):
+        return int(self.array.pitches[self.idx])
+
+    @midipitch.setter
+    def midipitch(self, pitch):
+        self.array.pitches[self.idx] = pitch
+
+    @property
+    def sharp(self):
+        return bool(self.array.sharps[self.idx])
+
+    @sharp.setter
+    def sharp(self, sharp):
+        self.array.sharps[self.idx] = sharp
+
+    @property
+    def flat(self):
+        return bool(self.array.flats[self.idx])
+
+    @flat.setter
+    def flat(self, flat):
+        self.array.flats[self.idx] = flat
+
+
+class NoteArray(object):
+    """A sequence of single notes stored as numpy arrays of durations,
+    pitches and sharp / flat flags, so the whole sequence can be transposed,
+    re-timed or put in a key in one call. Indexing and iterating give
+    NoteRefs, so a NoteArray can be used wherever a list of Notes is."""
+
+    def __init__(self, notes=()):
+        super().__init__()
+        self.durs = np.array([n.get_dur() for n in notes], dtype=np.int64)
+        self.pitches = np.array([n.get_pitch() for n in notes], dtype=np.int64)
+        self.sharps = np.array([n.sharp for n in notes], dtype=np.bool_)
+        self.flats = np.array([n.flat for n in notes], dtype=np.bool_)
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("NoteArray index out of range")
+        return NoteRef(self, idx)
+
+    def __iter__(self):
+        return (NoteRef(self, i) for i in range(len(self)))
+
+    def get_letters(self):
+        return [pitch_to_letter(p) for p in self.pitches.tolist()]
+
+    def transpose(self, offset):
+        self.pitches += offset
+
+    def set_dur(self, dur):
+        self.durs[:] = dur
+
+    # raise the notes whose letter is in sharps and lower the ones whose
+    # letter is in flats, undoing any earlier key first. Same as calling
+    # remove_sharp / remove_flat / add_sharp / add_flat on each note.
+    def set_key(self, sharps, flats):
+        letter = kLetterIndex[self.pitches % 12]
+        in_sharps = self._letter_mask(sharps)[letter]
+        in_flats = self._letter_mask(flats)[letter]
+
+        remove = self.sharps & ~in_sharps
+        self.pitches -= remove
+        self.sharps &= ~remove
+
+        remove = self.flats & ~in_flats
+        self.pitches += remove
+        self.flats &= ~remove
+
+        # skip notes already spelled as the sharp of their letter
+        pc = self.pitches % 12
+        add = in_sharps & ~self.sharps & ~(kIsSharp[pc] & (kLetterIndex[pc] == letter))
+        self.pitches += add
+        self.sharps |= add
+
+        # skip notes already spelled as the sharp of the letter below
+        pc = self.pitches % 12
+        below = (letter - 1) % len(kLetters)
+        add = in_flats & ~self.flats & ~(kIsSharp[pc] & (kLetterIndex[pc] == below))
+        self.pitches -= add
+        self.flats |= add
+
+    @staticmethod
+    def _letter_mask(letters):
+        mask = np.zeros(len(kLetters), dtype=np.bool_)
+        mask[[kLetters.index(l) for l in letters]] = True
+        return mask
+
+
+# benchmark: compiling a sequence against updating only its pitches after a
+# transpose (what the piano puzzle does on every pitch or key change), and
+# transposing / changing key note by note against one NoteArray call.
+# Run with: python -m src.puzzle_sound
+if __name__ == "__main__":
+    notes = [Note(240, 60 + i % 12) for i in range(64)]
+    reps = 1000
+
+    # the loop PianoPuzzle.update_key used to run
+    def update_key(notes, key_sig):
+        for note in notes:
+            base_letter = note.get_letter()[0]
+            letter_before = kLetters[kLetters.index(base_letter) - 1]
+            if base_letter not in key_sig["#"]:
+                note.remove_sharp()
+            if base_letter not in key_sig["b"]:
+                note.remove_flat()
+            if base_letter in key_sig["#"] and note.get_letter()[:-1] != base_letter + "#":
+                note.add_sharp()
+            if base_letter in key_sig["b"] and note.get_letter()[:-1] != letter_before + "#":
+                note.add_flat()
+
+    key_sig = {"#": [], "b": ["B", "E"]}
+    t = time.perf_counter()
+    for i in range(reps):
+        for note in notes:
+            note.set_note(note.get_pitch() + 1)
+        update_key(notes, key_sig)
+    t_loop = (time.perf_counter() - t) / reps
+
+    array = NoteArray(notes)
+    t = time.perf_counter()
+    for i in range(reps):
+        array.transpose(1)
+        array.set_key(key_sig["#"], key_sig["b"])
+    t_array = (time.perf_counter() - t) / reps
+
+    print(f"{len(notes)} notes: transpose + key per note {1e6 * t_loop:.1f}us, NoteArray {1e6 * t_array:.1f}us")
+
+    t = time.perf_counter()
+    for i in range(reps):
+        timeline = NoteTimeline(notes, 1, 60)
+    t_compile = (time.perf_counter() - t) / reps
+
+    t = time.perf_counter()
+    for i in range(reps):
+        timeline.update_pitches()
+    t_update = (time.perf_counter() - t) / reps
+
+    print(f"{len(notes)} notes: compile {1e6 * t_compile:.1f}us, update pitches {1e6 * t_update:.1f}us")
@@ -0,0 +1,145 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.core.image import ImageLoader
+
+# written by build_atlas.py
+kAtlasIndex = "./data/atlas/atlas.json"
+
+
+class TextureCache(object):
+    """
+    Process-wide registry of image textures. Each image file is decoded and
+    uploaded once, and everyone drawing it shares the same Texture.
+
+    preload() decodes files on a background thread ahead of time (eg, the
+    rooms behind the doors of the current room), so that when a room is
+    built only the GPU upload is left to do on the main thread. Textures
+    themselves can only be created on the main thread.
+
+    Images packed into the texture atlas (see build_atlas.py) are handed out
+    as regions of their atlas page, so they all share a few page textures.
+    """
+
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, atlas_index=kAtlasIndex):
+        super().__init__()
+        self.textures = {}
+
+        # atlas page files, and normalized source path -> its atlas region
+        self.pages = []
+        self.regions = {}
+        if atlas_index and os.path.exists(atlas_index):
+            self._load_atlas_index(atlas_index)
+
+        # source -> Future of the decoded image, for preloads not yet used
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # hits: textures handed out without decoding on the main thread.
+        # misses: decoded on (or waited for by) the main thread
+        self.num_hits = 0
+        self.num_misses = 0
+        self.decode_time = 0.0
+        self.upload_time = 0.0
+        self.texture_bytes = 0
+
+    # the texture of the image file source, or None if source is None. Each
+    # call counts as one hit or one miss, atlas regions included
+    def get_texture(self, source):
+        if source is None:
+            return None
+
+        texture = self.textures.get(source)
+        if texture is not None:
+            self.num_hits += 1
+            return texture
+
+        region = self.regions.get(os.path.normpath(source))
+        if region is not None:
+            # a region is as much a hit or miss as loading its page
+            page, hit = self._load(self.pages[region["page"]])
+            texture = page.get_region(*region["region"])
+            self.textures[source] = texture
+        else:
+            texture, hit = self._load(source)
+
+        if hit:
+            self.num_hits += 1
+        else:
+            self.num_misses += 1
+        return texture
+
+    # (texture, hit) for a whole image file, hit being False if it had to be
+    # decoded on (or waited for by) the main thread
+    def _load(self, source):
+        texture = self.textures.get(source)
+        if texture is not None:
+            return texture, True
+
+        future = self.pending.pop(source, None)
+        hit = future is not None and future.done()
+        if future is not None:
+            image, decode_time = future.result()
+        else:
+            image, decode_time = self._decode(source)
+        self.decode_time += decode_time
+
+        t = time.perf_counter()
+        texture = image.texture
+        self.upload_time += time.perf_counter() - t
+        self.texture_bytes += texture.width * texture.height * 4
+
+        self.textures[source] = texture
+        return texture, hit
+
+    # start decoding sources on the background thread. Sources already
+    # loaded or on their way are skipped
+    def preload(self, sources):
+        for source in sources:
+            region = self.regions.get(os.path.normpath(source))
+            if region is not None:
+                source = self.pages[region["page"]]
+            if source not in self.textures and source not in self.pending:
+                self.pending[source] = self.executor.submit(self._decode, source)
+
+    def get_stats(self):
+        return {
+            "textures": len(self.textures),
+            "hits": self.num_hits,
+            "misses": self.num_misses,
+            "decode_time": self.decode_time,
+            "upload_time": self.upload_time,
+            "texture_bytes": self.texture_bytes,
+        }
+
+    def _load_atlas_index(self, filepath):
+        with open(filepath) as f:
+            index = json.load(f)
+        atlas_dir = os.path.dirname(filepath)
+        self.pages = [os.path.join(atlas_dir, page) for page in index["pages"]]
+        self.regions = index["regions"]
+
+    # runs on either thread. Only reads the file into memory, and returns the
+    # image with the seconds it took (added to the stats by the main thread)
+    def _decode(self, source):
+        t = time.perf_counter()
+        image = ImageLoader.load(source, nocache=True)
+        return image, time.perf_counter() - t
+
+
+def get_texture(source):
+    return TextureCache.get().get_texture(source)
+
+
+def preload(sources):
+    TextureCache.get().preload(sources)
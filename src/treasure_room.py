@@ -3,16 +3,25 @@ from kivy.core.window import Window
 from common.gfxutil import CLabelRect, CRectangle
 
 from common.audio import Audio
-from common.mixer import Mixer
 from common.wavegen import WaveGenerator
-from common.wavesrc import WaveFile
+from common.wavesrc import MappedWaveFile
 
+from src.audio_engine import AudioEngine
 from src.button import Button
 from src.grid import DoorTile, Tile
 from src.puzzle import Puzzle
+from src.textures import get_texture
 
 
 class TreasureRoom(Puzzle):
+    texture_sources = Puzzle.texture_sources + (
+        "./data/guitar.png",
+        "./data/bass.png",
+        "./data/drums.png",
+        "./data/piano.png",
+        "./data/treasure.png",
+    )
+
     def __init__(self, level=0, prev_room=None, on_finished_puzzle=None):
         super().__init__()
         self.create_objects()
@@ -20,11 +29,15 @@ class TreasureRoom(Puzzle):
         self.blocks_placed = 0
         self.create_treasure_popup((Window.width, Window.height))
 
-        self.audio = Audio(2)
-        self.mixer = Mixer()
-        self.mixer.set_gain(0.2)
-        self.audio.set_generator(self.mixer)
-        self.wave_file_gen = WaveGenerator(WaveFile("./data/treasure_music.wav"))
+        self.audio = AudioEngine.get()
+        # loop the music for as long as the player stays, crossfading a quarter
+        # second at the loop point so it is seamless
+        self.wave_file_gen = WaveGenerator(
+            MappedWaveFile("./data/treasure_music.wav"),
+            loop=True,
+            crossfade=Audio.sample_rate // 4,
+        )
+        self.wave_file_gen.set_gain(0.2)
 
     """ Mandatory Puzzle methods """
 
@@ -82,21 +95,8 @@ class TreasureRoom(Puzzle):
         if self.is_valid_pos(obj_loc) and self.valid_block_move(
             obj_loc, self.objects[new_location].move_range
         ):
-            self.remove(self.objects[new_location])
-            obj = MovingBlock(
-                self.objects[new_location].size,
-                self.grid.grid_to_pixel(obj_loc),
-                self.objects[new_location].move_range,
-                self.objects[new_location].color,
-                self.objects[new_location].icon_source,
-                self.objects[new_location].final_position,
-            )
-            del self.objects[new_location]
-
-            self.add(PushMatrix())
-            self.add(Translate(*self.grid.pos))
-            self.add(obj)
-            self.add(PopMatrix())
+            obj = self.objects.pop(new_location)
+            obj.set_pos(self.grid.grid_to_pixel(obj_loc))
 
             self.objects[obj_loc] = obj
             self.blocks_placed += self.objects[obj_loc].on_block_placement(obj_loc)
@@ -126,9 +126,10 @@ class TreasureRoom(Puzzle):
                             self.character.grid_pos
                         ].other_room(self, self.level + 1)
                     return self.objects[self.character.grid_pos].other_room
-            if self.blocks_placed == 4:
+            # the music starts once. From then on on_enter/on_exit manage it
+            if self.blocks_placed == 4 and not self.game_over:
                 self.on_game_over()
-                self.mixer.add(self.wave_file_gen)
+                self.audio.add(self.wave_file_gen)
 
 
     def create_treasure_popup(self, win_size):
@@ -144,7 +145,7 @@ class TreasureRoom(Puzzle):
         self.treasure = CRectangle(
             cpos=(win_size[0] // 2, win_size[1] // 4),
             csize=(win_size[0] // 4, win_size[1] // 4),
-            source='./data/treasure.png'
+            texture=get_texture('./data/treasure.png')
         )
 
     def on_game_over(self):
@@ -157,6 +158,14 @@ class TreasureRoom(Puzzle):
         self.add(self.treasure)
 
 
+    # the music only plays while the player is in this room
+    def on_enter(self):
+        if self.game_over:
+            self.audio.add(self.wave_file_gen)
+
+    def on_exit(self):
+        self.audio.remove(self.wave_file_gen)
+
     def on_update(self):
         self.audio.on_update()
 
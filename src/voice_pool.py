@@ -0,0 +1,53 @@
+class VoicePool(object):
+    """
+    Keeps track of the notes sounding on each synth channel. When a channel
+    already has max_voices notes sounding, its oldest note is stopped to make
+    room for the new one (voice stealing), so voices can't pile up in the
+    synth. All note ons and note offs for a channel should go through here.
+    """
+
+    def __init__(self, synth, max_voices=8):
+        super().__init__()
+        self.synth = synth
+        self.max_voices = max_voices
+
+        # channel -> {pitch: None}, in the order the notes started
+        self.active = {}
+        self.num_stolen = 0
+
+    def note_on(self, channel, pitch, vel):
+        voices = self.active.setdefault(channel, {})
+        if pitch in voices:
+            # retriggered: it is now the newest note
+            del voices[pitch]
+        elif len(voices) >= self.max_voices:
+            oldest = next(iter(voices))
+            del voices[oldest]
+            self.synth.noteoff(channel, oldest)
+            self.num_stolen += 1
+
+        voices[pitch] = None
+        self.synth.noteon(channel, pitch, vel)
+
+    # stop all of pitches that are still sounding (stolen ones are skipped)
+    def note_off(self, channel, pitches):
+        voices = self.active.get(channel)
+        if not voices:
+            return
+        for pitch in pitches:
+            if pitch in voices:
+                del voices[pitch]
+                self.synth.noteoff(channel, pitch)
+
+    # stop everything on the channel with a single all-notes-off
+    def release(self, channel):
+        self.active.pop(channel, None)
+        self.synth.cc(channel, 123, 0)
+
+    def get_num_active(self, channel=None):
+        if channel is not None:
+            return len(self.active.get(channel, ()))
+        return sum(len(voices) for voices in self.active.values())
+
+    def get_num_stolen(self):
+        return self.num_stolen